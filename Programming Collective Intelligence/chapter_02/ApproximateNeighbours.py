@@ -0,0 +1,274 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,近似最近邻索引.
+精确的top_matches每次查询都要与所有用户比较,用户数很大时无法承受.
+这里用局部敏感哈希(LSH)把相似的用户分到同一个桶中,查询时只在同桶的候选用户中精确计算.
+
+方法:
+    CosineLSH: 随机超平面哈希,评分向量在每个超平面哪一侧构成一位签名,
+        两个向量签名相同的概率随夹角增大而减小,对应完整评分向量的余弦相似度sim_vector_cosine.
+    MinHashLSH: 最小哈希,评过分的物品集合在随机排列下的最小值相同的概率
+        等于两个集合的Jaccard系数sim_jaccard,即0/1评分下的谷本系数.
+    注意sim_cosine和sim_tanimoto只在共有物品上计算,只有一部共有电影时也可能为1,
+    与哈希所近似的完整向量上的相似度不同,所以这里另外定义了这两个相似度.
+    两者都使用多个哈希表(或分段),任一表中同桶即为候选.
+    表越多召回率越高,每个表的位数越多桶越小,查询越快.
+"""
+
+import random
+import time
+from math import sqrt
+
+import numpy as np
+
+from RatingMatrix import sums_formula, register_kernel
+from BatchSimilarity import as_matrix
+
+__author__ = 'Guti'
+
+
+def _dense(product):
+    """
+    帮助函数,稀疏矩阵的乘积转换为一维稠密数组
+    """
+    if hasattr(product, 'toarray'):
+        product = product.toarray()
+    return np.asarray(product).ravel()
+
+
+def sim_vector_cosine(prefs, person1, person2):
+    """
+    完整评分向量的余弦相似度,没有评分的物品视为0
+    """
+    p_sum = sum([rating * prefs[person2][item] for item, rating in prefs[person1].items()
+                 if item in prefs[person2]])
+    den = sqrt(sum([pow(r, 2) for r in prefs[person1].values()]) *
+               sum([pow(r, 2) for r in prefs[person2].values()]))
+    if den == 0:
+        return 0
+    return p_sum / den
+
+
+def sim_jaccard(prefs, person1, person2):
+    """
+    评过分的物品集合的Jaccard系数
+    """
+    shared = len([item for item in prefs[person1] if item in prefs[person2]])
+    union = len(prefs[person1]) + len(prefs[person2]) - shared
+    if union == 0:
+        return 0
+    return float(shared) / union
+
+
+def _vector_cosine(matrix, person, rows):
+    """
+    帮助函数,向量化的sim_vector_cosine,只计算指定的行
+    """
+    x, _ = matrix.row(person)
+    norms = np.sqrt(_dense(matrix.squares[rows].sum(axis=1)) * x.dot(x))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(norms > 0, _dense(matrix.values[rows].dot(x)) / norms, 0.0)
+
+
+def _jaccard(matrix, person, rows):
+    """
+    帮助函数,向量化的sim_jaccard,只计算指定的行
+    """
+    _, m = matrix.row(person)
+    shared = _dense(matrix.mask[rows].dot(m))
+    union = _dense(matrix.mask[rows].sum(axis=1)) + m.sum() - shared
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, shared / union, 0.0)
+
+
+# 只计算部分行的向量化实现
+_ROW_KERNELS = {
+    sim_vector_cosine: _vector_cosine,
+    sim_jaccard: _jaccard,
+}
+
+for _similarity, _row_kernel in _ROW_KERNELS.items():
+    register_kernel(_similarity, lambda matrix, person, _k=_row_kernel: _k(matrix, person, slice(None)))
+
+
+def candidate_similarity(matrix, person, candidates, similarity=sim_vector_cosine):
+    """
+    只计算用户与候选用户的相似度,与RatingMatrix的向量化实现结果相同
+    :param matrix: 评分矩阵
+    :param person: 待计算的用户
+    :param candidates: 候选用户的行号数组
+    :param similarity: 相似度计算方法
+    :return: 与候选用户对应的相似度数组
+    """
+    if similarity in _ROW_KERNELS:
+        return _ROW_KERNELS[similarity](matrix, person, candidates)
+    formula = sums_formula(similarity)
+    if formula is None:
+        return np.array([similarity(matrix, person, matrix.users[i]) for i in candidates], dtype=np.float64)
+    x, m = matrix.row(person)
+    values, mask, squares = matrix.values[candidates], matrix.mask[candidates], matrix.squares[candidates]
+    return formula(_dense(mask.dot(m)), _dense(mask.dot(x)), _dense(values.dot(m)),
+                   _dense(mask.dot(x ** 2)), _dense(squares.dot(m)), _dense(values.dot(x)))
+
+
+class _LSHIndex(object):
+    """
+    LSH索引的公共部分,子类负责计算每个用户在每个表中的桶键
+    """
+    similarity = None
+
+    def __init__(self, prefs):
+        self.matrix = as_matrix(prefs)
+        self.tables = list()
+
+    def _build(self, keys):
+        """
+        帮助函数,由每个表中每个用户的桶键建立哈希表
+        :param keys: 形状为(表数, 用户数)的桶键序列
+        """
+        self.tables = list()
+        for table_keys in keys:
+            buckets = dict()
+            for u, key in enumerate(table_keys):
+                buckets.setdefault(key, []).append(u)
+            self.tables.append((table_keys, buckets))
+
+    def candidates(self, person):
+        """
+        获取与用户在任一表中同桶的候选用户
+        :param person: 用户
+        :return: 候选用户的行号数组,不包括自身
+        """
+        u = self.matrix.user_index[person]
+        found = set()
+        for table_keys, buckets in self.tables:
+            found.update(buckets[table_keys[u]])
+        found.discard(u)
+        return np.array(sorted(found), dtype=np.int64)
+
+    def query(self, person, n=5, similarity=None):
+        """
+        近似的top_matches,只在候选用户中精确计算相似度
+        :param person: 用户
+        :param n: 取n个最相似的其他用户
+        :param similarity: 相似度计算方法,默认为索引对应的相似度
+        :return: 一个由元组(相似度, 其他用户)组成的列表
+        """
+        if similarity is None:
+            similarity = self.similarity
+        candidates = self.candidates(person)
+        scores = candidate_similarity(self.matrix, person, candidates, similarity)
+        ranked = [(float(score), self.matrix.users[i]) for score, i in zip(scores, candidates)]
+        ranked.sort(reverse=True)
+        return ranked[:n]
+
+
+class CosineLSH(_LSHIndex):
+    """
+    随机超平面哈希索引,对应完整评分向量的余弦相似度
+    """
+    similarity = staticmethod(sim_vector_cosine)
+
+    def __init__(self, prefs, tables=8, bits=8, seed=None):
+        """
+        :param prefs: 评分表或评分矩阵
+        :param tables: 哈希表个数,越多召回率越高
+        :param bits: 每个表的签名位数,越多桶越小,查询越快
+        :param seed: 随机种子
+        """
+        super(CosineLSH, self).__init__(prefs)
+        rng = np.random.RandomState(seed)
+        planes = rng.randn(len(self.matrix.items), tables * bits)
+        signs = np.asarray(self.matrix.values.dot(planes)) > 0
+        # 每个表的签名位组合为一个整数桶键
+        weights = 1 << np.arange(bits, dtype=np.int64)
+        keys = [signs[:, t * bits:(t + 1) * bits].dot(weights) for t in range(tables)]
+        self._build(keys)
+
+
+class MinHashLSH(_LSHIndex):
+    """
+    最小哈希索引,对应评过分的物品集合的Jaccard系数,即0/1评分的谷本系数
+    """
+    similarity = staticmethod(sim_jaccard)
+
+    # 大于物品个数的素数,用于随机哈希 (a*x + b) % p
+    _PRIME = 2147483647
+
+    def __init__(self, prefs, bands=16, rows=4, seed=None):
+        """
+        :param prefs: 评分表或评分矩阵
+        :param bands: 分段个数,即哈希表个数,越多召回率越高
+        :param rows: 每段的最小哈希个数,越多桶越小,查询越快
+        :param seed: 随机种子
+        """
+        super(MinHashLSH, self).__init__(prefs)
+        rng = random.Random(seed)
+        hashes = bands * rows
+        a = np.array([rng.randint(1, self._PRIME - 1) for _ in range(hashes)], dtype=np.int64)
+        b = np.array([rng.randint(0, self._PRIME - 1) for _ in range(hashes)], dtype=np.int64)
+
+        signatures = np.full((len(self.matrix.users), hashes), self._PRIME, dtype=np.int64)
+        for u, person in enumerate(self.matrix.users):
+            _, m = self.matrix.row(person)
+            items = np.flatnonzero(m).astype(np.int64)
+            if len(items):
+                signatures[u] = ((np.outer(items, a) + b) % self._PRIME).min(axis=0)
+
+        keys = [[tuple(row) for row in signatures[:, t * rows:(t + 1) * rows]] for t in range(bands)]
+        self._build(keys)
+
+
+def benchmark(index, users=None, n=10, similarity=None):
+    """
+    与精确的top_matches比较召回率和每秒查询数
+    召回率按得分计算: 近似结果中得分不低于精确结果第n名的个数除以n,避免同分时名称不同被误判
+    :param index: 近似最近邻索引
+    :param users: 查询的用户列表,默认为全部用户
+    :param n: 取n个最相似的其他用户
+    :param similarity: 相似度计算方法,默认为索引对应的相似度
+    :return: 字典,包括平均召回率, 精确查询和近似查询的每秒查询数
+    """
+    from recommendations import top_matches
+
+    if similarity is None:
+        similarity = index.similarity
+    if users is None:
+        users = index.matrix.users
+
+    start = time.time()
+    exact = [top_matches(index.matrix, user, n=n, similarity=similarity) for user in users]
+    exact_seconds = time.time() - start
+
+    start = time.time()
+    approximate = [index.query(user, n=n, similarity=similarity) for user in users]
+    approximate_seconds = time.time() - start
+
+    recalls = list()
+    for truth, found in zip(exact, approximate):
+        if not truth:
+            continue
+        threshold = truth[-1][0]
+        recalls.append(float(len([score for score, _ in found if score >= threshold])) / len(truth))
+
+    return {'recall': sum(recalls) / len(recalls) if recalls else 1.0,
+            'exact_qps': len(users) / exact_seconds if exact_seconds > 0 else float('inf'),
+            'approximate_qps': len(users) / approximate_seconds if approximate_seconds > 0 else float('inf')}
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens
+
+    movielens_matrix = as_matrix(load_movielens())
+
+    print '随机超平面哈希,不同参数下的召回率与每秒查询数:'
+    for tables, bits in [(8, 6), (16, 6), (32, 6)]:
+        result = benchmark(CosineLSH(movielens_matrix, tables=tables, bits=bits, seed=0))
+        print '\t%2d个表, 每表%2d位: recall@10 = %.3f, 精确 %.0f 次/秒, 近似 %.0f 次/秒' % (
+            tables, bits, result['recall'], result['exact_qps'], result['approximate_qps'])
+
+    print '\n最小哈希,不同参数下的召回率与每秒查询数:'
+    for bands, rows in [(32, 3), (16, 2), (32, 2)]:
+        result = benchmark(MinHashLSH(movielens_matrix, bands=bands, rows=rows, seed=0))
+        print '\t%2d段, 每段%d个哈希: recall@10 = %.3f, 精确 %.0f 次/秒, 近似 %.0f 次/秒' % (
+            bands, rows, result['recall'], result['exact_qps'], result['approximate_qps'])
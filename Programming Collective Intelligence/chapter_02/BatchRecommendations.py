@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,批量为多个用户推荐.
+逐个用户调用get_recommendations或get_recommended_items时每次都要扫描评分表,
+这里把一批用户的评分权重总和与相似度总和都写成矩阵乘积,一次得到整批的估算评分.
+
+方法:
+    基于用户: 记这批用户与所有用户的相似度矩阵为S(忽略自身和小于等于0的相似度),
+        评分权重总和 = S·X, 相似度总和 = S·M
+    基于物品: 记相似物品表构成的矩阵为W, W[i, j]为物品j在物品i的相似列表中的相似度,
+        评分权重总和 = Xb·W, 相似度总和 = Mb·W
+    估算评分 = 评分权重总和 / 相似度总和, 只保留用户没有评分的物品.
+    矩阵乘积的求和顺序与逐个累加不同,估算评分与get_recommendations相差约1e-14,
+    本来相同的评分也可能出现这样微小的差别.排序时评分保留10位小数,相同的再按名称排序,
+    结果与分块无关;get_recommendations按精确的评分排序,评分相同的物品之间的顺序可能与这里不同.
+"""
+
+import numpy as np
+
+from recommendations import sim_pearson
+from BatchSimilarity import as_matrix, rows_similarity, top_n_of
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+__author__ = 'Guti'
+
+# 自动分块时每一块估算评分矩阵的元素个数上限
+_BLOCK_ELEMENTS = 1 << 21
+
+# 排序时评分保留的小数位数,忽略矩阵乘积与逐个累加之间的浮点误差
+_RANK_DECIMALS = 10
+
+
+def _times(dense, matrix):
+    """
+    帮助函数,稠密数组左乘评分矩阵(稠密或稀疏),返回稠密数组
+    """
+    if hasattr(matrix, 'toarray'):
+        return np.asarray(matrix.T.dot(dense.T)).T
+    return dense.dot(matrix)
+
+
+def _dense_rows(matrix, rows):
+    """
+    帮助函数,取出若干行并转换为稠密数组
+    """
+    block = matrix[rows]
+    if hasattr(block, 'toarray'):
+        return block.toarray()
+    return np.asarray(block)
+
+
+def _item_weights(matrix, item_match):
+    """
+    帮助函数,把相似物品表转换为 物品×物品 的权重矩阵
+    :return: 元组(权重矩阵, 出现矩阵),出现矩阵标记物品j是否在物品i的相似列表中
+    """
+    rows, cols, data = list(), list(), list()
+    for item, matches in item_match.items():
+        if item not in matrix.item_index:
+            continue
+        for similarity, item2 in matches:
+            rows.append(matrix.item_index[item])
+            cols.append(matrix.item_index[item2])
+            data.append(similarity)
+
+    shape = (len(matrix.items), len(matrix.items))
+    if sp is not None:
+        weights = sp.csr_matrix((data, (rows, cols)), shape=shape)
+        present = sp.csr_matrix((np.ones(len(data)), (rows, cols)), shape=shape)
+        return weights, present
+    weights = np.zeros(shape)
+    present = np.zeros(shape)
+    weights[rows, cols] = data
+    present[rows, cols] = 1
+    return weights, present
+
+
+def recommend_batch(prefs, users, similarity=sim_pearson, k=30, item_match=None, block_size=None):
+    """
+    为一批用户推荐物品
+    :param prefs: 评分表或评分矩阵
+    :param users: 需要推荐的用户列表
+    :param similarity: 基于用户推荐时的相似度计算方法
+    :param k: 每个用户推荐的个数
+    :param item_match: 相似物品表,给出时与get_recommended_items相同,基于物品推荐;
+                       为None时与get_recommendations相同,基于用户推荐
+    :param block_size: 每块的用户数,为None时自动选择
+    :return: 字典,用户到推荐排行表(长度不超过k),评分只差浮点误差的物品按名称排序
+    """
+    matrix = as_matrix(prefs)
+    rows = np.array([matrix.user_index[user] for user in users], dtype=np.int64)
+    if block_size is None:
+        block_size = max(1, _BLOCK_ELEMENTS // max(len(matrix.items), len(matrix.users), 1))
+    if item_match is not None:
+        weights, present = _item_weights(matrix, item_match)
+
+    result = dict()
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        own = _dense_rows(matrix.values, block)
+        rated = _dense_rows(matrix.mask, block)
+
+        if item_match is None:
+            sims = rows_similarity(matrix, block, similarity)
+            # 不计算与自身的相似度,相似度小于等于0忽略
+            sims[np.arange(len(block)), block] = 0
+            sims[sims < 0] = 0
+            totals = _times(sims, matrix.values)
+            sim_sums = _times(sims, matrix.mask)
+            # 只推荐用户没有评分(或评分为0)而相似用户评过分的物品
+            valid = (sim_sums > 0) & (own == 0)
+        else:
+            totals = _times(own, weights)
+            sim_sums = _times(rated, weights)
+            # 只推荐出现在用户评过分物品的相似列表中,而用户自己没有评分的物品
+            valid = (_times(rated, present) > 0) & (rated == 0) & (sim_sums != 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = totals / sim_sums
+        for offset, u in enumerate(block):
+            result[matrix.users[u]] = top_n_of(scores[offset], np.flatnonzero(valid[offset]), matrix.items, k,
+                                               decimals=_RANK_DECIMALS)
+    return result
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens
+    from NeighbourCache import NeighbourTableCache
+    import time
+
+    prefs_dict = load_movielens()
+    movielens_matrix = as_matrix(prefs_dict)
+
+    start = time.time()
+    user_based = recommend_batch(movielens_matrix, movielens_matrix.users)
+    print '基于用户为全部%d个用户推荐,用时%.3f秒' % (len(user_based), time.time() - start)
+    print user_based['87'][:5]
+
+    item_sim = NeighbourTableCache().item_match(prefs_dict, n=50, dataset='movielens')
+    start = time.time()
+    item_based = recommend_batch(movielens_matrix, movielens_matrix.users, item_match=item_sim)
+    print '基于物品为全部%d个用户推荐,用时%.3f秒' % (len(item_based), time.time() - start)
+    print item_based['87'][:5]
@@ -0,0 +1,201 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,批量计算相似度矩阵.
+calculate_similar_items和calculate_similar_users对每一行调用一次top_matches,
+这里改为按行分块,每一块与所有行的相似度由矩阵乘积一次得到,再用部分排序取出前n个.
+
+方法:
+    记分块的评分矩阵为Xb,掩码矩阵为Mb,平方矩阵为Qb,全体的分别为X,M,Q,则
+        共有物品个数 N = Mb·Mᵀ
+        求和 S1 = Xb·Mᵀ, S2 = Mb·Xᵀ
+        平方和 Q1 = Qb·Mᵀ, Q2 = Mb·Qᵀ
+        乘积和 P = Xb·Xᵀ
+    再套用RatingMatrix中的求和公式即可得到整块的相似度.
+"""
+
+import time
+
+import numpy as np
+
+from recommendations import sim_pearson, sim_distance
+from RatingMatrix import RatingMatrix, sums_formula
+
+__author__ = 'Guti'
+
+# 自动分块时每一块相似度矩阵的元素个数上限
+_BLOCK_ELEMENTS = 1 << 21
+
+
+def _dense(product):
+    """
+    帮助函数,稀疏矩阵的乘积转换为稠密数组
+    """
+    if hasattr(product, 'toarray'):
+        return product.toarray()
+    return np.asarray(product)
+
+
+def rows_similarity(matrix, rows, similarity=sim_pearson):
+    """
+    计算指定的若干行与所有行的相似度
+    :param matrix: 评分矩阵
+    :param rows: 行的切片或行号数组
+    :param similarity: 相似度计算方法
+    :return: 形状为(行数, 全部行数)的相似度数组
+    """
+    formula = sums_formula(similarity)
+    if formula is None:
+        # 没有求和公式的相似度函数,逐行计算
+        indices = np.arange(len(matrix.users))[rows]
+        return np.array([matrix.similarities(matrix.users[i], similarity) for i in indices])
+
+    values, mask, squares = matrix.values, matrix.mask, matrix.squares
+    xb, mb, qb = values[rows], mask[rows], squares[rows]
+    return formula(_dense(mb.dot(mask.T)),
+                   _dense(xb.dot(mask.T)),
+                   _dense(mb.dot(values.T)),
+                   _dense(qb.dot(mask.T)),
+                   _dense(mb.dot(squares.T)),
+                   _dense(xb.dot(values.T)))
+
+
+def block_similarity(matrix, start, end, similarity=sim_pearson):
+    """
+    计算第start到end行与所有行的相似度
+    :param matrix: 评分矩阵
+    :param start: 分块的起始行
+    :param end: 分块的结束行(不包括)
+    :param similarity: 相似度计算方法
+    :return: 形状为(end-start, 行数)的相似度数组
+    """
+    return rows_similarity(matrix, slice(start, end), similarity)
+
+
+def iter_similarity_blocks(matrix, similarity=sim_pearson, block_size=None):
+    """
+    分块计算全部行两两之间的相似度
+    :param matrix: 评分矩阵
+    :param similarity: 相似度计算方法
+    :param block_size: 每块的行数,为None时按行数自动选择
+    :return: 生成器,每次产生元组(起始行, 相似度数组)
+    """
+    rows = len(matrix.users)
+    if block_size is None:
+        block_size = max(1, _BLOCK_ELEMENTS // max(rows, 1))
+    for start in range(0, rows, block_size):
+        end = min(start + block_size, rows)
+        yield start, block_similarity(matrix, start, end, similarity)
+
+
+def top_n_of(scores, candidates, names, n, decimals=None):
+    """
+    从候选位置中取出得分最高的n个,排序方式与对(得分, 名称)元组完整排序相同
+    先用argpartition找到第n大的值,只对不小于它的候选排序
+    :param scores: 得分数组
+    :param candidates: 候选位置数组
+    :param names: 与得分对应的名称列表
+    :param n: 取前n个
+    :param decimals: 给出时按保留decimals位小数的得分排序,只差浮点误差的得分视为相同,再按名称排序;
+                     返回的仍是原来的得分
+    :return: 一个由元组(得分, 名称)组成的列表
+    """
+    keys = scores if decimals is None else np.round(scores, decimals)
+    candidate_keys = keys[candidates]
+    if n < len(candidates):
+        threshold = candidate_keys[np.argpartition(-candidate_keys, n - 1)[n - 1]]
+        # 与第n个相等的值都保留,保证与完整排序的结果一致
+        candidates = candidates[candidate_keys >= threshold]
+    ranked = [(float(keys[j]), names[j], float(scores[j])) for j in candidates]
+    ranked.sort(reverse=True)
+    return [(score, name) for _, name, score in ranked[:n]]
+
+
+def top_n_from_row(scores, names, index, n):
+    """
+    从一行相似度中取出前n个,排序方式与top_matches相同
+    :param scores: 一行相似度数组
+    :param names: 与相似度对应的名称列表
+    :param index: 该行自身的位置,不参与排序
+    :param n: 取前n个
+    :return: 一个由元组(相似度, 名称)组成的列表
+    """
+    return top_n_of(scores, np.delete(np.arange(len(scores)), index), names, n)
+
+
+def similarity_table(matrix, n=10, similarity=sim_pearson, block_size=None):
+    """
+    计算每一行最相似的n行
+    :param matrix: 评分矩阵,按行计算相似度
+    :param n: 相似个数
+    :param similarity: 相似度计算方法
+    :param block_size: 每块的行数
+    :return: 元组(相似表, 统计信息),统计信息包括计算的配对数,用时和每秒配对数
+    """
+    result = dict()
+    names = matrix.users
+    start_time = time.time()
+    for start, block in iter_similarity_blocks(matrix, similarity, block_size):
+        for offset in range(block.shape[0]):
+            i = start + offset
+            result[names[i]] = top_n_from_row(block[offset], names, i, n)
+
+    seconds = time.time() - start_time
+    pairs = len(names) * len(names)
+    stats = {'pairs': pairs,
+             'seconds': seconds,
+             'pairs_per_second': pairs / seconds if seconds > 0 else float('inf')}
+    return result, stats
+
+
+def as_matrix(prefs):
+    """
+    评分表转换为评分矩阵,已经是评分矩阵时直接返回
+    """
+    if isinstance(prefs, RatingMatrix):
+        return prefs
+    return RatingMatrix.from_prefs(prefs)
+
+
+def calculate_similar_items_batch(prefs, n=10, similarity=sim_distance, block_size=None):
+    """
+    批量计算相似物品表,结果与calculate_similar_items相同
+    :param prefs: 评分表或评分矩阵
+    :param n: 相似个数
+    :param similarity: 相似度计算方法
+    :param block_size: 每块的行数
+    :return: 相似物品表
+    """
+    result, stats = similarity_table(as_matrix(prefs).transpose(), n, similarity, block_size)
+    print '%d 对物品, 用时 %.2f 秒, 每秒 %.0f 对' % (stats['pairs'], stats['seconds'], stats['pairs_per_second'])
+    return result
+
+
+def calculate_similar_users_batch(prefs, n=5, similarity=sim_pearson, block_size=None):
+    """
+    批量计算相似用户表,结果与UserSimilarity.calculate_similar_users相同
+    :param prefs: 评分表或评分矩阵
+    :param n: 相似个数
+    :param similarity: 相似度计算方法
+    :param block_size: 每块的行数
+    :return: 相似用户表
+    """
+    result, stats = similarity_table(as_matrix(prefs), n, similarity, block_size)
+    print '%d 对用户, 用时 %.2f 秒, 每秒 %.0f 对' % (stats['pairs'], stats['seconds'], stats['pairs_per_second'])
+    return result
+
+
+if __name__ == '__main__':
+    from recommendations import critics, load_movielens, get_recommended_items
+
+    print '批量计算相似物品表'
+    print calculate_similar_items_batch(critics)['Superman Returns']
+
+    print '\n使用MovieLens数据集:'
+    prefs_dict = load_movielens()
+    item_sim = calculate_similar_items_batch(prefs_dict, n=50)
+    print '\t使用相似物品表给87用户推荐电影'
+    print get_recommended_items(prefs_dict, item_sim, '87')[:30]
+
+    user_sim = calculate_similar_users_batch(prefs_dict)
+    print '\t与87用户最相似的用户'
+    print user_sim['87']
@@ -0,0 +1,321 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,推荐引擎的性能测试.
+对sim_pearson, top_matches, get_recommendations, calculate_similar_items和get_recommended_items
+分别计时,数据集为MovieLens十万条数据和规模为一百万, 一千万条评分的合成数据.
+结果保存为JSON文件,不同提交的结果可以用compare比较.
+
+方法:
+    每个阶段在fork出的子进程中运行,子进程继承已经准备好的评分表, 转置表和相似物品表,
+    只对阶段本身计时,并用resource读取子进程的内存峰值,各阶段的内存峰值互不影响.
+    合成数据的物品很多,calculate_similar_items只对抽样的物品计算(与其内层循环相同),
+    并按比例估计全部物品的用时.
+
+用法:
+    python Benchmark.py --datasets movielens,synthetic-1m
+    python Benchmark.py --compare data/benchmarks/old.json data/benchmarks/new.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import Queue
+import random
+import resource
+import subprocess
+import time
+
+import numpy as np
+
+from recommendations import (sim_pearson, sim_distance, top_matches, get_recommendations,
+                             calculate_similar_items, get_recommended_items, load_movielens, _transform_prefs)
+
+__author__ = 'Guti'
+
+
+def synthetic_prefs(ratings, users, items, seed=0):
+    """
+    生成合成评分表,物品热度近似Zipf分布,评分由用户偏好, 物品质量和噪声决定
+    :param ratings: 评分条数(去重前)
+    :param users: 用户数
+    :param items: 物品数
+    :param seed: 随机种子
+    :return: 评分表,用户为'u编号',物品为'i编号'
+    """
+    rng = np.random.RandomState(seed)
+    popularity = 1.0 / np.arange(1, items + 1) ** 0.8
+    popularity /= popularity.sum()
+
+    user_ids = rng.randint(0, users, ratings)
+    item_ids = rng.choice(items, ratings, p=popularity)
+    # 同一用户对同一物品只保留一条评分
+    keys = np.unique(user_ids.astype(np.int64) * items + item_ids)
+    user_ids, item_ids = keys // items, keys % items
+
+    user_bias = rng.normal(0, 0.5, users)
+    item_bias = rng.normal(0, 0.7, items)
+    values = np.clip(np.round(3.5 + user_bias[user_ids] + item_bias[item_ids] + rng.normal(0, 0.8, len(keys))), 1, 5)
+
+    user_names = ['u%d' % u for u in range(users)]
+    item_names = ['i%d' % i for i in range(items)]
+    prefs = dict()
+    for u, i, r in zip(user_ids.tolist(), item_ids.tolist(), values.tolist()):
+        prefs.setdefault(user_names[u], {})[item_names[i]] = r
+    return prefs
+
+
+# 数据集名称到(加载函数, calculate_similar_items抽样的物品数,None表示全部)
+DATASETS = {
+    'movielens': (lambda: load_movielens(), None),
+    'synthetic-1m': (lambda: synthetic_prefs(1000000, 6000, 4000), 200),
+    'synthetic-10m': (lambda: synthetic_prefs(10000000, 70000, 10000), 100),
+}
+
+
+def _bench_sim_pearson(context):
+    """
+    随机用户配对上的sim_pearson
+    """
+    prefs = context['prefs']
+    for person1, person2 in context['pairs']:
+        sim_pearson(prefs, person1, person2)
+    return len(context['pairs'])
+
+
+def _bench_top_matches(context):
+    prefs = context['prefs']
+    for person in context['users']:
+        top_matches(prefs, person, n=5)
+    return len(context['users'])
+
+
+def _bench_get_recommendations(context):
+    prefs, item_prefs = context['prefs'], context['item_prefs']
+    for person in context['users']:
+        get_recommendations(prefs, person, item_prefs=item_prefs, k=30)
+    return len(context['users'])
+
+
+def _bench_calculate_similar_items(context):
+    """
+    不抽样时直接调用calculate_similar_items,抽样时只对抽样的物品执行其内层循环
+    """
+    if context['items'] is None:
+        calculate_similar_items(context['prefs'], n=10)
+        return len(context['item_prefs'])
+    item_prefs = context['item_prefs']
+    for item in context['items']:
+        top_matches(item_prefs, item, n=10, similarity=sim_distance)
+    return len(context['items'])
+
+
+def _bench_get_recommended_items(context):
+    prefs, item_match = context['prefs'], context['item_match']
+    for person in context['users']:
+        get_recommended_items(prefs, item_match, person, k=30)
+    return len(context['users'])
+
+
+# 阶段名称到(测试函数, 需要预先准备的数据)
+STAGES = [
+    ('sim_pearson', _bench_sim_pearson, ()),
+    ('top_matches', _bench_top_matches, ()),
+    ('get_recommendations', _bench_get_recommendations, ('item_prefs',)),
+    ('calculate_similar_items', _bench_calculate_similar_items, ('item_prefs',)),
+    ('get_recommended_items', _bench_get_recommended_items, ('item_match',)),
+]
+
+
+def _prepare(context, needs):
+    """
+    帮助函数,在父进程中准备阶段需要的数据,不计入阶段用时
+    """
+    if 'item_prefs' in needs and 'item_prefs' not in context:
+        context['item_prefs'] = _transform_prefs(context['prefs'])
+    if 'item_match' in needs and 'item_match' not in context:
+        # 批量计算的相似物品表与calculate_similar_items相同
+        from BatchSimilarity import calculate_similar_items_batch
+        context['item_match'] = calculate_similar_items_batch(context['prefs'], n=10)
+
+
+def _max_rss_mb():
+    # Linux上ru_maxrss的单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _run_stage(func, context, queue):
+    """
+    帮助函数,在子进程中运行一个阶段,结果放入队列
+    """
+    before = _max_rss_mb()
+    start = time.time()
+    ops = func(context)
+    seconds = time.time() - start
+    after = _max_rss_mb()
+    queue.put({'ops': ops, 'seconds': seconds, 'peak_rss_mb': after, 'rss_growth_mb': after - before})
+
+
+def run_stage(func, context, timeout=None):
+    """
+    在fork出的子进程中运行一个阶段
+    :param timeout: 最长运行时间(秒),超时终止子进程,None表示不限
+    :return: 字典,包括操作数, 用时, 每秒操作数, 内存峰值和阶段内的内存增长(MB);
+             子进程异常退出(如内存不足被系统终止)或超时时failed为True,并给出退出码和原因
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_stage, args=(func, context, queue))
+    start = time.time()
+    process.start()
+    result = error = None
+    while result is None and error is None:
+        try:
+            result = queue.get(timeout=1.0)
+        except Queue.Empty:
+            if not process.is_alive():
+                # 子进程可能在放入结果后才退出,再读一次
+                try:
+                    result = queue.get(timeout=1.0)
+                except Queue.Empty:
+                    error = 'stage process exited without a result'
+            elif timeout is not None and time.time() - start > timeout:
+                process.terminate()
+                error = 'timed out after %.0f seconds' % timeout
+    process.join()
+
+    if result is None:
+        return {'failed': True, 'error': error, 'exitcode': process.exitcode, 'ops': 0,
+                'seconds': time.time() - start, 'ops_per_second': 0.0}
+    result['failed'] = False
+    result['ops_per_second'] = result['ops'] / result['seconds'] if result['seconds'] > 0 else float('inf')
+    return result
+
+
+def benchmark_dataset(name, prefs, users=50, pairs=20000, items=None, stages=None, seed=0, timeout=None):
+    """
+    在一个数据集上运行各个阶段
+    :param name: 数据集名称
+    :param prefs: 评分表
+    :param users: top_matches和推荐阶段抽样的用户数
+    :param pairs: sim_pearson阶段抽样的用户配对数
+    :param items: calculate_similar_items抽样的物品数,None表示全部物品
+    :param stages: 运行的阶段名称列表,None表示全部
+    :param seed: 抽样的随机种子
+    :param timeout: 每个阶段的最长运行时间(秒),None表示不限
+    :return: 每个阶段的结果字典组成的列表
+    """
+    rng = random.Random(seed)
+    people = sorted(prefs)
+    context = {'prefs': prefs,
+               'users': rng.sample(people, min(users, len(people))),
+               'pairs': [(rng.choice(people), rng.choice(people)) for _ in range(pairs)],
+               'items': None}
+    if items is not None:
+        all_items = sorted(set(item for person in prefs for item in prefs[person]))
+        context['items'] = rng.sample(all_items, min(items, len(all_items)))
+
+    results = list()
+    for stage, func, needs in STAGES:
+        if stages is not None and stage not in stages:
+            continue
+        _prepare(context, needs)
+        result = run_stage(func, context, timeout)
+        result.update({'dataset': name, 'stage': stage})
+        if result['failed']:
+            print '%-14s %-24s 失败: %s, 退出码 %s' % (name, stage, result['error'], result['exitcode'])
+            results.append(result)
+            continue
+        if stage == 'calculate_similar_items' and items is not None:
+            # 按抽样比例估计全部物品的用时
+            result['estimated_total_seconds'] = result['seconds'] * len(context['item_prefs']) / result['ops']
+        print '%-14s %-24s %8d 次 %9.3f 秒 %10.1f 次/秒  内存峰值 %.0f MB' % (
+            name, stage, result['ops'], result['seconds'], result['ops_per_second'], result['peak_rss_mb'])
+        results.append(result)
+    return results
+
+
+def _commit():
+    """
+    帮助函数,当前的git提交,不在git仓库中时返回None
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, path):
+    """
+    保存结果及运行环境为JSON文件
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    report = {'commit': _commit(),
+              'python': platform.python_version(),
+              'machine': platform.platform(),
+              'cpus': multiprocessing.cpu_count(),
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+
+def compare(old_path, new_path):
+    """
+    比较两次运行的结果,打印每个阶段每秒操作数的变化
+    :return: 字典,(数据集, 阶段)到新旧每秒操作数之比
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    # json读入的是unicode,数据集和阶段名称都是ascii,转换为str便于与中文格式串拼接
+    old_results = dict(((str(r['dataset']), str(r['stage'])), r) for r in old['results'])
+
+    ratios = dict()
+    print '%s -> %s' % (old.get('commit'), new.get('commit'))
+    for r in new['results']:
+        key = (str(r['dataset']), str(r['stage']))
+        if key not in old_results or not old_results[key]['ops_per_second']:
+            continue
+        if r.get('failed'):
+            print '%-14s %-24s 本次失败: %s' % (key[0], key[1], r.get('error'))
+            continue
+        ratios[key] = r['ops_per_second'] / old_results[key]['ops_per_second']
+        print '%-14s %-24s %10.1f -> %10.1f 次/秒  x%.2f' % (
+            key[0], key[1], old_results[key]['ops_per_second'], r['ops_per_second'], ratios[key])
+    return ratios
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='推荐引擎性能测试')
+    parser.add_argument('--datasets', default='movielens', help='逗号分隔: ' + ','.join(sorted(DATASETS)))
+    parser.add_argument('--stages', default=None, help='逗号分隔的阶段名称,默认全部')
+    parser.add_argument('--users', type=int, default=50, help='抽样的用户数')
+    parser.add_argument('--pairs', type=int, default=20000, help='sim_pearson抽样的配对数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=None, help='每个阶段的最长运行时间(秒)')
+    parser.add_argument('--output', default=None, help='结果文件,默认为data/benchmarks/时间.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='比较两个结果文件')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        selected = args.stages.split(',') if args.stages else None
+        all_results = list()
+        for dataset in args.datasets.split(','):
+            loader, item_sample = DATASETS[dataset]
+            start_time = time.time()
+            dataset_prefs = loader()
+            print '加载 %s: %d 个用户, 用时 %.1f 秒' % (dataset, len(dataset_prefs), time.time() - start_time)
+            all_results.extend(benchmark_dataset(dataset, dataset_prefs, users=args.users, pairs=args.pairs,
+                                                 items=item_sample, stages=selected, seed=args.seed,
+                                                 timeout=args.timeout))
+        output = args.output or 'data/benchmarks/%s.json' % time.strftime('%Y%m%d-%H%M%S')
+        save_results(all_results, output)
+        print '结果已保存到 %s' % output
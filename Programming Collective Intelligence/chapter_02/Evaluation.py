@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,离线评估推荐效果和速度.
+load_movielens丢弃了时间戳,这里按时间划分训练集和测试集:用较早的评分训练,预测较晚的评分,
+与实际使用时只能依据过去的评分推荐一致.
+
+指标:
+    RMSE/MAE: 推荐列表中的估算评分与测试集中实际评分的误差,只统计能给出估算的物品,另报告覆盖率.
+    precision/recall@k: 测试集中评分不低于threshold的物品视为相关,统计前k个推荐的命中情况.
+    延迟: 每个用户一次推荐的用时,报告平均值, p50和p99.
+    多个推荐方法(不同相似度, 基于用户或物品)在同一次运行中用相同的划分评估,便于比较准确度与速度.
+"""
+
+import multiprocessing
+import time
+
+import numpy as np
+
+from recommendations import sim_pearson, get_recommendations, get_recommended_items, _transform_prefs
+from RatingStream import iter_rating_chunks, load_titles
+
+__author__ = 'Guti'
+
+
+def time_split(path='data/movielens', test_fraction=0.2, per_user=True):
+    """
+    按时间戳划分训练集和测试集
+    :param path: MovieLens数据集路径
+    :param test_fraction: 测试集比例
+    :param per_user: 为True时每个用户最晚的一部分评分作为测试集;
+                     为False时按全局时间点划分,该时间点之后的评分作为测试集
+    :return: 元组(训练评分表, 测试评分表)
+    """
+    records = list()
+    for chunk in iter_rating_chunks(path + '/u.data', items=load_titles(path)):
+        records.extend(chunk)
+    # 同一时间的评分按用户和物品排序,保证划分结果确定
+    records.sort(key=lambda r: (r[3], r[0], r[1]))
+
+    train, test = dict(), dict()
+    if per_user:
+        by_user = dict()
+        for record in records:
+            by_user.setdefault(record[0], []).append(record)
+        for user, user_records in by_user.items():
+            cut = len(user_records) - int(round(len(user_records) * test_fraction))
+            # 至少保留一条训练评分
+            cut = max(cut, 1)
+            for _, item, rating, _ in user_records[:cut]:
+                train.setdefault(user, {})[item] = rating
+            for _, item, rating, _ in user_records[cut:]:
+                test.setdefault(user, {})[item] = rating
+    else:
+        index = int(len(records) * (1 - test_fraction))
+        # test_fraction为0时没有测试集
+        cutoff = records[index][3] if index < len(records) else float('inf')
+        for user, item, rating, ts in records:
+            target = train if ts < cutoff else test
+            target.setdefault(user, {})[item] = rating
+
+    # 训练集中已经评过分的物品(不同id同名的影片)不再出现在测试集中
+    for user in list(test):
+        for item in list(test[user]):
+            if item in train.get(user, {}):
+                del test[user][item]
+        if not test[user] or user not in train:
+            del test[user]
+    return train, test
+
+
+def user_based(similarity=sim_pearson, label=None):
+    """
+    基于用户的推荐方法,使用get_recommendations
+    :param label: 方法名称,默认为'user/'加相似度函数的名称,加权相似度的名称包括其参数
+    :return: 元组(方法名称, 推荐函数)
+    """
+    def recommend(context, user):
+        return get_recommendations(context['train'], user, similarity, item_prefs=context['item_prefs'])
+    return label or 'user/%s' % similarity.__name__, recommend
+
+
+def item_based(n=50, label=None):
+    """
+    基于物品的推荐方法,使用get_recommended_items,相似物品表在训练集上计算一次
+    :param n: 相似物品表中每个物品的相似个数
+    :param label: 方法名称,默认为'item/n=相似个数'
+    :return: 元组(方法名称, 推荐函数)
+    """
+    def recommend(context, user):
+        return get_recommended_items(context['train'], context['item_match'][n], user)
+    recommend.item_match_size = n
+    return label or 'item/n=%d' % n, recommend
+
+
+# 多进程评估时,子进程通过fork继承的训练集, 测试集和推荐方法
+_context = None
+
+
+def _evaluate_user(args):
+    """
+    帮助函数,用一个推荐方法评估一个用户
+    :return: 字典,包括误差列表, 命中数, 推荐数, 相关数和用时
+    """
+    m, user, k, threshold = args
+    recommend = _context['methods'][m][1]
+    actual = _context['test'][user]
+
+    start = time.time()
+    ranked = recommend(_context, user)
+    seconds = time.time() - start
+
+    predicted = dict((item, score) for score, item in ranked)
+    errors = [predicted[item] - rating for item, rating in actual.items() if item in predicted]
+    relevant = set(item for item, rating in actual.items() if rating >= threshold)
+    top = [item for _, item in ranked[:k]]
+    return {'errors': errors,
+            'tested': len(actual),
+            'hits': len([item for item in top if item in relevant]),
+            'recommended': len(top),
+            'relevant': len(relevant),
+            'seconds': seconds}
+
+
+def _summarize(results, k):
+    """
+    帮助函数,汇总一个方法在所有用户上的结果
+    """
+    errors = np.array([e for r in results for e in r['errors']])
+    latencies = np.array([r['seconds'] for r in results])
+    tested = sum(r['tested'] for r in results)
+    # precision和recall按用户平均,没有相关物品的用户不计入recall
+    precisions = [float(r['hits']) / k for r in results]
+    recalls = [float(r['hits']) / r['relevant'] for r in results if r['relevant'] > 0]
+    return {'users': len(results),
+            'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else float('nan'),
+            'mae': float(np.mean(np.abs(errors))) if len(errors) else float('nan'),
+            'coverage': float(len(errors)) / tested if tested else 0.0,
+            'precision@%d' % k: float(np.mean(precisions)) if precisions else 0.0,
+            'recall@%d' % k: float(np.mean(recalls)) if recalls else 0.0,
+            'latency_mean': float(latencies.mean()),
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p99': float(np.percentile(latencies, 99))}
+
+
+def evaluate(train, test, methods, k=10, threshold=4.0, users=None, workers=None):
+    """
+    在同一个划分上评估多个推荐方法
+    :param train: 训练评分表
+    :param test: 测试评分表
+    :param methods: 由(方法名称, 推荐函数)组成的列表,如user_based(sim_distance), item_based(),
+                    名称不能重复
+    :param k: precision/recall@k的k
+    :param threshold: 测试评分不低于该值的物品视为相关
+    :param users: 评估的用户列表,默认为测试集的全部用户
+    :param workers: 进程数,大于1时按用户并行
+    :return: 字典,方法名称到指标字典
+    """
+    global _context
+    names = [name for name, _ in methods]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError('推荐方法名称重复: %s,请通过label参数区分' % ', '.join(duplicates))
+    if users is None:
+        users = sorted(test)
+    _context = {'train': train, 'test': test, 'methods': methods,
+                'item_prefs': _transform_prefs(train), 'item_match': dict()}
+    # 相似物品表在父进程中计算,子进程直接继承
+    for name, recommend in methods:
+        size = getattr(recommend, 'item_match_size', None)
+        if size is not None and size not in _context['item_match']:
+            from BatchSimilarity import calculate_similar_items_batch
+            _context['item_match'][size] = calculate_similar_items_batch(train, n=size)
+
+    pool = multiprocessing.Pool(workers) if workers is not None and workers > 1 else None
+    summary = dict()
+    try:
+        for m, (name, _) in enumerate(methods):
+            tasks = [(m, user, k, threshold) for user in users]
+            start = time.time()
+            if pool is None:
+                results = map(_evaluate_user, tasks)
+            else:
+                results = pool.map(_evaluate_user, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+            summary[name] = _summarize(results, k)
+            summary[name]['seconds'] = time.time() - start
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _context = None
+    return summary
+
+
+if __name__ == '__main__':
+    from recommendations import sim_distance
+    from Tanimoto import sim_tanimoto
+
+    train_prefs, test_prefs = time_split()
+    print '训练集 %d 个用户, 测试集 %d 个用户, %d 条评分' % (
+        len(train_prefs), len(test_prefs), sum(len(v) for v in test_prefs.values()))
+
+    # 只评估前200个测试用户,全部用户可以去掉users参数
+    report = evaluate(train_prefs, test_prefs,
+                      [user_based(sim_pearson), user_based(sim_distance), user_based(sim_tanimoto), item_based(50)],
+                      k=10, users=sorted(test_prefs)[:200], workers=multiprocessing.cpu_count())
+    for method in sorted(report):
+        r = report[method]
+        print '%-18s RMSE %.3f  MAE %.3f  覆盖率 %.2f  P@10 %.3f  R@10 %.3f  延迟 p50 %.1fms p99 %.1fms  总用时 %.1f秒' % (
+            method, r['rmse'], r['mae'], r['coverage'], r['precision@10'], r['recall@10'],
+            r['latency_p50'] * 1000, r['latency_p99'] * 1000, r['seconds'])
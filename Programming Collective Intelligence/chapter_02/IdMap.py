@@ -0,0 +1,214 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,用户和物品名称到整数编号的映射.
+load_movielens的每个内层字典都以完整的电影标题为键,_transform_prefs又把这些键复制一遍.
+这里把名称映射为连续的整数编号,评分表内部只使用整数,只在接口处转换名称.
+
+方法:
+    编号按名称排序后依次分配,所以按(得分, 编号)排序与按(得分, 名称)排序的结果相同,
+    同分时的顺序也与原来的函数一致.
+    同一个名称始终对应同一个整数对象,评分表中的键不会重复占用内存.
+"""
+
+import sys
+
+from recommendations import (sim_pearson, sim_distance, top_matches, get_recommendations,
+                             calculate_similar_items, get_recommended_items, _transform_prefs)
+
+__author__ = 'Guti'
+
+
+class IdMap(object):
+    """
+    名称与连续整数编号的双向映射
+    """
+    def __init__(self, names=()):
+        """
+        :param names: 名称序列,排序去重后依次分配编号
+        """
+        self.names = list()
+        self.ids = dict()
+        for name in sorted(set(names)):
+            self.intern(name)
+
+    def intern(self, name):
+        """
+        获取名称的编号,不存在时分配下一个编号
+        注意之后分配的编号不再保证与名称的排序一致
+        """
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def id_of(self, name):
+        return self.ids[name]
+
+    def name_of(self, i):
+        return self.names[i]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+
+def intern_prefs(prefs):
+    """
+    把评分表中的用户和物品名称替换为整数编号
+    :param prefs: 以名称为键的评分表
+    :return: 元组(以编号为键的评分表, 用户映射, 物品映射)
+    """
+    users = IdMap(prefs)
+    items = IdMap(item for person in prefs for item in prefs[person])
+    result = dict()
+    for person, ratings in prefs.items():
+        result[users.ids[person]] = dict((items.ids[item], rating) for item, rating in ratings.items())
+    return result, users, items
+
+
+def load_movielens_interned(path='data/movielens'):
+    """
+    与load_movielens读取相同的数据,但直接生成以编号为键的评分表,
+    电影标题只保存在物品映射中
+    :param path: 数据集路径
+    :return: 元组(以编号为键的评分表, 用户映射, 物品映射)
+    """
+    titles = dict()
+    with open(path + '/u.item') as f:
+        for line in f:
+            m_id, title = line.split('|')[:2]
+            titles[m_id] = title
+
+    ratings = list()
+    with open(path + '/u.data') as f:
+        for line in f:
+            u_id, m_id, rating, ts = line.split('\t')
+            ratings.append((u_id, m_id, float(rating)))
+
+    users = IdMap(u_id for u_id, _, _ in ratings)
+    # 不同的影片id可能有相同的标题,与load_movielens一样按标题合并
+    items = IdMap(titles[m_id] for _, m_id, _ in ratings)
+    movie_ids = dict((m_id, items.ids[title]) for m_id, title in titles.items() if title in items)
+
+    prefs = dict()
+    for u_id, m_id, rating in ratings:
+        prefs.setdefault(users.ids[u_id], {})[movie_ids[m_id]] = rating
+    return prefs, users, items
+
+
+class InternedPrefs(object):
+    """
+    以编号为键的评分表,推荐接口接收和返回名称,内部计算只使用编号
+    """
+    def __init__(self, prefs, users, items):
+        """
+        :param prefs: 以编号为键的评分表
+        :param users: 用户映射
+        :param items: 物品映射
+        """
+        self.prefs = prefs
+        self.users = users
+        self.items = items
+        self._item_prefs = None
+
+    @classmethod
+    def from_prefs(cls, prefs):
+        """
+        由以名称为键的评分表创建
+        """
+        return cls(*intern_prefs(prefs))
+
+    @property
+    def item_prefs(self):
+        """
+        转置后的评分表,第一次使用时计算
+        """
+        if self._item_prefs is None:
+            self._item_prefs = _transform_prefs(self.prefs)
+        return self._item_prefs
+
+    def to_prefs(self):
+        """
+        转换回以名称为键的评分表
+        """
+        return dict((self.users.names[u], dict((self.items.names[i], rating) for i, rating in ratings.items()))
+                    for u, ratings in self.prefs.items())
+
+    def _named(self, ranked, names):
+        """
+        帮助函数,把排行表中的编号转换为名称
+        """
+        return [(score, names[i]) for score, i in ranked]
+
+    def top_matches(self, person, n=5, similarity=sim_pearson):
+        """
+        与recommendations.top_matches相同
+        """
+        return self._named(top_matches(self.prefs, self.users.ids[person], n, similarity), self.users.names)
+
+    def get_recommendations(self, person, similarity=sim_pearson, k=None):
+        """
+        与recommendations.get_recommendations相同
+        """
+        ranked = get_recommendations(self.prefs, self.users.ids[person], similarity, self.item_prefs, k)
+        return self._named(ranked, self.items.names)
+
+    def calculate_similar_items(self, n=10):
+        """
+        计算以编号为键的相似物品表,用于get_recommended_items
+        """
+        return calculate_similar_items(self.prefs, n)
+
+    def get_recommended_items(self, item_match, person, k=None):
+        """
+        与recommendations.get_recommended_items相同
+        :param item_match: calculate_similar_items返回的以编号为键的相似物品表
+        """
+        return self._named(get_recommended_items(self.prefs, item_match, self.users.ids[person], k),
+                           self.items.names)
+
+    def item_match_names(self, item_match):
+        """
+        以编号为键的相似物品表转换为以名称为键
+        """
+        return dict((self.items.names[i], self._named(matches, self.items.names))
+                    for i, matches in item_match.items())
+
+
+def prefs_size(prefs):
+    """
+    粗略估计评分表占用的内存字节数,包括字典和键,相同的键对象只计算一次
+    """
+    seen = set()
+    total = sys.getsizeof(prefs)
+    for person, ratings in prefs.items():
+        total += sys.getsizeof(ratings)
+        for key in [person] + ratings.keys():
+            if id(key) not in seen:
+                seen.add(id(key))
+                total += sys.getsizeof(key)
+    return total
+
+
+if __name__ == '__main__':
+    from recommendations import critics, load_movielens
+    import time
+
+    interned = InternedPrefs.from_prefs(critics)
+    print '给 Toby 推荐电影,内部使用编号计算'
+    print interned.get_recommendations('Toby')
+    print interned.top_matches('Toby', n=3, similarity=sim_distance)
+
+    print '\n使用MovieLens数据集:'
+    prefs_dict = load_movielens()
+    interned = InternedPrefs(*load_movielens_interned())
+    print '\t评分表约 %d 字节, 转置后约 %d 字节' % (prefs_size(prefs_dict), prefs_size(_transform_prefs(prefs_dict)))
+    print '\t编号评分表约 %d 字节, 转置后约 %d 字节' % (prefs_size(interned.prefs), prefs_size(interned.item_prefs))
+
+    start = time.time()
+    print '\t依据相似用户给87用户的推荐电影'
+    print interned.get_recommendations('87', k=30)
+    print '\t用时%.4f秒' % (time.time() - start)
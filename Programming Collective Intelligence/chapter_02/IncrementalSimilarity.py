@@ -0,0 +1,216 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,增量维护相似表.
+新的评分到来时不再重新计算整个相似表,而是只更新受影响的配对.
+
+方法:
+    sim_pearson, sim_distance, sim_tanimoto和sim_cosine只依赖两者共有属性上的
+    共有个数, 求和, 平方和, 乘积和. 对每一对记录这些统计量,
+    用户A对物品i评分时,只有A与其他评价过i的用户这些配对的统计量发生变化,
+    再只刷新这些配对所在的相似列表即可.
+"""
+
+import heapq
+
+from recommendations import sim_pearson, sim_distance
+from Tanimoto import sim_tanimoto, sim_cosine
+from SimilarityFormulas import distance_from_sums, pearson_from_sums, tanimoto_from_sums, cosine_from_sums
+
+__author__ = 'Guti'
+
+
+# 相似度函数与统计量公式的对应关系
+STAT_FORMULAS = {
+    sim_distance: distance_from_sums,
+    sim_pearson: pearson_from_sums,
+    sim_tanimoto: tanimoto_from_sums,
+    sim_cosine: cosine_from_sums,
+}
+
+
+class IncrementalNeighbours(object):
+    """
+    增量维护的相似表.
+    by='users'时维护相似用户表(同calculate_similar_users),
+    by='items'时维护相似物品表(同calculate_similar_items).
+    注意: 没有任何共有属性的配对不会出现在相似列表中.
+    """
+    def __init__(self, prefs=None, n=5, similarity=sim_pearson, by='users'):
+        """
+        :param prefs: 初始评分表,可以为None
+        :param n: 相似列表的长度
+        :param similarity: 相似度计算方法,支持sim_pearson, sim_distance, sim_tanimoto, sim_cosine
+        :param by: 'users'或'items',相似表的键是用户还是物品
+        """
+        if similarity not in STAT_FORMULAS:
+            raise ValueError('unsupported similarity: %r' % similarity)
+        if by not in ('users', 'items'):
+            raise ValueError("by must be 'users' or 'items'")
+        self.n = n
+        self.by = by
+        self._formula = STAT_FORMULAS[similarity]
+        # 键到{属性: 评分}的表,以及属性到{键: 评分}的倒排表
+        self._ratings = dict()
+        self._raters = dict()
+        # 配对的统计量,两个方向共享同一个列表,顺序以较小的键在前
+        self._pairs = dict()
+        # 相似表
+        self.neighbours = dict()
+
+        if prefs is not None:
+            for user in prefs:
+                for item, rating in prefs[user].items():
+                    self._add(*self._orient(user, item) + (rating,))
+            for key in self._ratings:
+                self._refresh(key)
+
+    def _orient(self, user, item):
+        """
+        帮助函数,把(用户, 物品)转换为(键, 属性)
+        """
+        if self.by == 'users':
+            return user, item
+        return item, user
+
+    def _update_pairs(self, key, attr, rating, sign):
+        """
+        帮助函数,把key在attr上的评分加入(sign=1)或移出(sign=-1)所有相关配对的统计量
+        :return: 统计量发生变化的其他键
+        """
+        affected = list()
+        for other, other_rating in self._raters.get(attr, {}).items():
+            if other == key:
+                continue
+            pairs = self._pairs.setdefault(key, {})
+            stats = pairs.get(other)
+            if stats is None:
+                stats = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+                pairs[other] = stats
+                self._pairs.setdefault(other, {})[key] = stats
+            # 统计量按较小的键在前的顺序记录
+            r1, r2 = (rating, other_rating) if key < other else (other_rating, rating)
+            stats[0] += sign
+            stats[1] += sign * r1
+            stats[2] += sign * r2
+            stats[3] += sign * r1 * r1
+            stats[4] += sign * r2 * r2
+            stats[5] += sign * r1 * r2
+            if stats[0] == 0:
+                del self._pairs[key][other]
+                del self._pairs[other][key]
+            affected.append(other)
+        return affected
+
+    def _add(self, key, attr, rating):
+        """
+        帮助函数,记录一条评分,已有评分时先移除旧值
+        :return: 统计量发生变化的其他键
+        """
+        affected = list()
+        if attr in self._ratings.get(key, {}):
+            affected = self._remove(key, attr)
+        affected += self._update_pairs(key, attr, rating, 1)
+        self._ratings.setdefault(key, {})[attr] = rating
+        self._raters.setdefault(attr, {})[key] = rating
+        return affected
+
+    def _remove(self, key, attr):
+        """
+        帮助函数,移除一条评分
+        :return: 统计量发生变化的其他键
+        """
+        rating = self._ratings[key].pop(attr)
+        del self._raters[attr][key]
+        return self._update_pairs(key, attr, rating, -1)
+
+    def similarity(self, key, other):
+        """
+        由记录的统计量计算两个键的相似度
+        """
+        stats = self._pairs.get(key, {}).get(other)
+        if stats is None:
+            return 0
+        n, sum1, sum2, sum1_sq, sum2_sq, p_sum = stats
+        if other < key:
+            sum1, sum2, sum1_sq, sum2_sq = sum2, sum1, sum2_sq, sum1_sq
+        return float(self._formula(n, sum1, sum2, sum1_sq, sum2_sq, p_sum))
+
+    def _refresh(self, key):
+        """
+        帮助函数,重新计算一个键的相似列表
+        """
+        scores = [(self.similarity(key, other), other) for other in self._pairs.get(key, {})]
+        self.neighbours[key] = heapq.nlargest(self.n, scores)
+
+    def _patch(self, key, other):
+        """
+        帮助函数,只有key与other的相似度变化时更新key的相似列表
+        :return: 相似列表是否发生变化
+        """
+        current = self.neighbours.get(key, [])
+        rest = [entry for entry in current if entry[1] != other]
+        was_in = len(rest) < len(current)
+        entry = None
+        if other in self._pairs.get(key, {}):
+            entry = (self.similarity(key, other), other)
+
+        if was_in and len(current) == self.n and (entry is None or entry < current[-1]):
+            # 原来在列表中而相似度下降,列表外的键可能补位,需要重新计算
+            self._refresh(key)
+            return True
+        if entry is not None and (was_in or len(current) < self.n or entry > current[-1]):
+            rest.append(entry)
+            self.neighbours[key] = heapq.nlargest(self.n, rest)
+            return True
+        if was_in:
+            self.neighbours[key] = rest
+            return True
+        return False
+
+    def _apply(self, key, affected):
+        """
+        帮助函数,评分变化后刷新受影响的相似列表
+        :return: 相似列表发生变化的键的集合
+        """
+        self._refresh(key)
+        changed = set([key])
+        for other in set(affected):
+            if self._patch(other, key):
+                changed.add(other)
+        return changed
+
+    def add_rating(self, user, item, value):
+        """
+        新增或修改一条评分
+        :param user: 用户
+        :param item: 物品
+        :param value: 评分
+        :return: 相似列表发生变化的键的集合
+        """
+        key, attr = self._orient(user, item)
+        return self._apply(key, self._add(key, attr, value))
+
+    def remove_rating(self, user, item):
+        """
+        删除一条评分
+        :param user: 用户
+        :param item: 物品
+        :return: 相似列表发生变化的键的集合
+        """
+        key, attr = self._orient(user, item)
+        return self._apply(key, self._remove(key, attr))
+
+
+if __name__ == '__main__':
+    from recommendations import critics, get_recommended_items
+
+    print '增量维护相似用户表'
+    users = IncrementalNeighbours(critics, n=3)
+    print users.neighbours['Toby']
+    print '\nToby 为 Lady in the Water 评分4.5后'
+    print users.add_rating('Toby', 'Lady in the Water', 4.5)
+    print users.neighbours['Toby']
+
+    print '\n增量维护相似物品表,给 Toby 推荐电影'
+    items = IncrementalNeighbours(critics, n=10, similarity=sim_distance, by='items')
+    print get_recommended_items(critics, items.neighbours, 'Toby')
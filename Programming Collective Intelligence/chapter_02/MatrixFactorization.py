@@ -0,0 +1,162 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,矩阵分解推荐.
+基于相似用户的get_recommendations每次推荐都要遍历整个评分表,
+这里用交替最小二乘(ALS)把评分矩阵分解为用户因子和物品因子,
+推荐时只需用户因子与所有物品因子做一次点积.
+
+方法:
+    记全局平均分为mu,用户因子为P,物品因子为Q,预测评分为 mu + P[u]·Q[i].
+    固定Q时每个用户的因子是一个k元线性方程组的解:
+        (Σ Q[i]Q[i]ᵀ + λ·n_u·I) P[u] = Σ (r_ui - mu) Q[i], 求和遍历用户评过分的物品i
+    其中 Σ Q[i]Q[i]ᵀ 对所有用户可以一次写成掩码矩阵与 Q[i]⊗Q[i] 的矩阵乘积,
+    再用numpy对一批方程组同时求解;固定P求Q同理.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from BatchSimilarity import as_matrix, top_n_of
+
+__author__ = 'Guti'
+
+
+def _solve_block(args):
+    """
+    帮助函数,对一块行求解因子,numpy求解时释放GIL,可以在线程池中并行
+    :param args: 元组(评分矩阵块, 掩码矩阵块, 另一侧因子, 另一侧因子的外积, 正则化系数)
+    :return: 这一块的因子
+    """
+    values, mask, other, outer, regularization = args
+    factors = other.shape[1]
+    counts = np.asarray(mask.sum(axis=1)).ravel()
+    a = np.asarray(mask.dot(outer)).reshape(-1, factors, factors)
+    a += (regularization * np.maximum(counts, 1))[:, None, None] * np.eye(factors)
+    b = np.asarray(values.dot(other))
+    return np.linalg.solve(a, b[:, :, None])[:, :, 0]
+
+
+class ALSRecommender(object):
+    """
+    交替最小二乘矩阵分解推荐
+    """
+    def __init__(self, factors=20, regularization=0.1, iterations=15, workers=None, block_size=1024, seed=None):
+        """
+        :param factors: 因子个数
+        :param regularization: 正则化系数
+        :param iterations: 迭代次数
+        :param workers: 求解方程组的线程数,为None时单线程
+        :param block_size: 每块求解的行数
+        :param seed: 随机种子
+        """
+        self.factors = factors
+        self.regularization = regularization
+        self.iterations = iterations
+        self.workers = workers
+        self.block_size = block_size
+        self.seed = seed
+        self.matrix = None
+        self.mean = 0.0
+        self.user_factors = None
+        self.item_factors = None
+
+    def _solve(self, values, mask, other, pool):
+        """
+        帮助函数,固定一侧因子,分块求解另一侧的因子
+        """
+        outer = (other[:, :, None] * other[:, None, :]).reshape(len(other), -1)
+        blocks = [(values[start:start + self.block_size], mask[start:start + self.block_size],
+                   other, outer, self.regularization)
+                  for start in range(0, values.shape[0], self.block_size)]
+        if pool is None:
+            return np.vstack([_solve_block(block) for block in blocks])
+        return np.vstack(pool.map(_solve_block, blocks))
+
+    def fit(self, prefs):
+        """
+        训练模型
+        :param prefs: 评分表或评分矩阵
+        :return: 模型自身
+        """
+        self.matrix = matrix = as_matrix(prefs)
+        mask = matrix.mask
+        self.mean = matrix.values.sum() / max(mask.sum(), 1)
+        if matrix.sparse:
+            # 只对有评分的位置减去平均分,保持稀疏
+            residuals = matrix.values.copy()
+            residuals.data -= self.mean
+        else:
+            residuals = (matrix.values - self.mean) * mask
+
+        rng = np.random.RandomState(self.seed)
+        self.user_factors = rng.normal(scale=0.1, size=(len(matrix.users), self.factors))
+        self.item_factors = rng.normal(scale=0.1, size=(len(matrix.items), self.factors))
+
+        pool = ThreadPool(self.workers) if self.workers is not None and self.workers > 1 else None
+        try:
+            residuals_t, mask_t = residuals.T, mask.T
+            if matrix.sparse:
+                residuals_t, mask_t = residuals_t.tocsr(), mask_t.tocsr()
+            for _ in range(self.iterations):
+                self.user_factors = self._solve(residuals, mask, self.item_factors, pool)
+                self.item_factors = self._solve(residuals_t, mask_t, self.user_factors, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return self
+
+    def predict(self, person, item):
+        """
+        预测用户对物品的评分
+        """
+        u = self.matrix.user_index[person]
+        i = self.matrix.item_index[item]
+        return float(self.mean + self.user_factors[u].dot(self.item_factors[i]))
+
+    def rmse(self, prefs):
+        """
+        计算评分表上的均方根误差,忽略模型中不存在的用户和物品
+        """
+        errors = [pow(self.predict(person, item) - rating, 2)
+                  for person in prefs if person in self.matrix.user_index
+                  for item, rating in prefs[person].items() if item in self.matrix.item_index]
+        if not errors:
+            return 0.0
+        return float(np.sqrt(np.mean(errors)))
+
+    def get_recommendations(self, person, k=None):
+        """
+        与recommendations.get_recommendations相同的返回格式,
+        只需用户因子与所有物品因子做一次点积
+        :param person: 待推荐的用户
+        :param k: 只返回前k个推荐,为None时返回全部
+        :return: 一个由元组(预测评分, 物品)组成的列表
+        """
+        u = self.matrix.user_index[person]
+        scores = self.mean + self.item_factors.dot(self.user_factors[u])
+        _, rated = self.matrix.row(person)
+        candidates = np.flatnonzero(rated == 0)
+        return top_n_of(scores, candidates, self.matrix.items, len(candidates) if k is None else k)
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens, get_recommendations
+    import time
+
+    prefs_dict = load_movielens()
+
+    start = time.time()
+    model = ALSRecommender(workers=4, seed=0).fit(prefs_dict)
+    print '训练ALS模型,用时%.3f秒,训练集RMSE %.3f' % (time.time() - start, model.rmse(prefs_dict))
+
+    start = time.time()
+    print '\t使用矩阵分解给87用户推荐电影'
+    print model.get_recommendations('87', k=30)
+    print '\t用时%.4f秒' % (time.time() - start)
+
+    start = time.time()
+    print '\t依据相似用户给87用户的推荐电影'
+    print get_recommendations(prefs_dict, '87', k=30)
+    print '\t用时%.4f秒' % (time.time() - start)
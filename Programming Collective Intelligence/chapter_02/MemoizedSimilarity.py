@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,带LRU缓存的相似度函数.
+sim_pearson(prefs, a, b)与sim_pearson(prefs, b, a)结果相同却各算一次,
+为不同用户多次调用get_recommendations时同一配对也会被反复计算.
+这里包装任意的sim_*函数,以无序配对为键缓存结果,可以直接作为similarity参数使用.
+
+注意:
+    包装的相似度函数必须是对称的,sim_pearson, sim_distance, sim_tanimoto, sim_cosine都满足.
+    用户的评分变化后需要调用invalidate,该用户参与的配对全部失效.
+"""
+
+import collections
+
+from recommendations import sim_pearson
+
+__author__ = 'Guti'
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class MemoizedSimilarity(object):
+    """
+    带LRU缓存的相似度函数,调用方式与被包装的函数相同
+    """
+    def __init__(self, similarity=sim_pearson, maxsize=100000):
+        """
+        :param similarity: 被包装的相似度函数
+        :param maxsize: 最多缓存的配对个数
+        """
+        self.similarity = similarity
+        self.maxsize = maxsize
+        self.__name__ = similarity.__name__
+        self.hits = 0
+        self.misses = 0
+        self._prefs = None
+        # 有序字典按最近使用的顺序排列,最早的在前
+        self._cache = collections.OrderedDict()
+        # 每个用户参与的配对,用于按用户失效
+        self._pairs_of = dict()
+
+    def __call__(self, prefs, person1, person2):
+        # 换了评分表,缓存全部失效
+        if prefs is not self._prefs:
+            self.clear()
+            self._prefs = prefs
+
+        key = (person1, person2) if person1 <= person2 else (person2, person1)
+        if key in self._cache:
+            self.hits += 1
+            value = self._cache.pop(key)
+            self._cache[key] = value
+            return value
+
+        self.misses += 1
+        value = self.similarity(prefs, person1, person2)
+        self._cache[key] = value
+        self._pairs_of.setdefault(person1, set()).add(key)
+        self._pairs_of.setdefault(person2, set()).add(key)
+        if len(self._cache) > self.maxsize:
+            self._discard(next(iter(self._cache)))
+        return value
+
+    def _discard(self, key):
+        """
+        帮助函数,删除一个配对的缓存
+        """
+        del self._cache[key]
+        for person in key:
+            pairs = self._pairs_of.get(person)
+            if pairs is not None:
+                pairs.discard(key)
+                if not pairs:
+                    del self._pairs_of[person]
+
+    def invalidate(self, person):
+        """
+        用户评分变化后,删除该用户参与的所有配对
+        :param person: 用户
+        """
+        for key in list(self._pairs_of.get(person, ())):
+            self._discard(key)
+
+    def clear(self):
+        """
+        清空缓存和计数
+        """
+        self._cache.clear()
+        self._pairs_of.clear()
+        self.hits = self.misses = 0
+
+    def cache_info(self):
+        """
+        :return: 命中次数, 未命中次数, 最大容量, 当前大小
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens, get_recommendations, _transform_prefs
+    import time
+
+    prefs_dict = load_movielens()
+    item_prefs = _transform_prefs(prefs_dict)
+    memo = MemoizedSimilarity(sim_pearson)
+
+    for user in ['87', '1', '500', '87', '1']:
+        start = time.time()
+        get_recommendations(prefs_dict, user, similarity=memo, item_prefs=item_prefs, k=30)
+        print '给%s用户推荐电影,用时%.3f秒, %s' % (user, time.time() - start, memo.cache_info())
+
+    print '\n87用户修改评分后'
+    prefs_dict['87']['Star Wars (1977)'] = 1.0
+    memo.invalidate('87')
+    print memo.cache_info()
@@ -0,0 +1,214 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,MovieLens数据集的二进制列存格式.
+load_movielens逐行解析文本并构造嵌套字典,每次启动都需要数秒,内存也是原始数据的许多倍.
+这里先一次性把数据集转换为按列存储的numpy文件,之后用内存映射加载,几乎不需要时间.
+
+格式:
+    转换后的目录中包括
+        users.npy       int32, 每条评分的用户id, 按用户id和影片排序
+        items.npy       int32, 每条评分的影片在标题表中的位置
+        ratings.npy     float32, 评分
+        timestamps.npy  int32, 评分时间戳
+        titles.txt      标题表, 每行一个影片标题
+    与load_movielens一致,同名的影片视为同一部,同一用户对它的多条评分只保留文件中最后一条.
+"""
+
+import collections
+import os
+from array import array
+
+import numpy as np
+
+from RatingMatrix import RatingMatrix
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+__author__ = 'Guti'
+
+_COLUMNS = ('users', 'items', 'ratings', 'timestamps')
+
+
+def convert_movielens(path='data/movielens', out=None, sep='\t', item_file='u.item', data_file='u.data',
+                      item_sep=None):
+    """
+    把MovieLens数据集转换为二进制列存格式,只需执行一次
+    :param path: 数据集路径
+    :param out: 输出目录,默认为数据集路径下的binary目录
+    :param sep: 评分文件的分隔符,十万条数据集为制表符,更大的数据集为'::'
+    :param item_file: 影片文件名
+    :param data_file: 评分文件名
+    :param item_sep: 影片文件的分隔符,默认在sep为制表符时为'|'(u.item),否则与sep相同(movies.dat)
+    :return: 输出目录
+    """
+    if item_sep is None:
+        item_sep = '|' if sep == '\t' else sep
+    if out is None:
+        out = os.path.join(path, 'binary')
+    if not os.path.isdir(out):
+        os.makedirs(out)
+
+    # 影片id到标题表位置的映射,同名影片共用一个位置
+    titles = list()
+    title_index = dict()
+    movies = dict()
+    with open(os.path.join(path, item_file)) as f:
+        for line in f:
+            m_id, title = line.rstrip('\r\n').split(item_sep)[:2]
+            if title not in title_index:
+                title_index[title] = len(titles)
+                titles.append(title)
+            movies[m_id] = title_index[title]
+
+    # 用紧凑的array逐行收集,避免生成大量Python对象
+    users, items, ratings, timestamps = array('i'), array('i'), array('f'), array('i')
+    with open(os.path.join(path, data_file)) as f:
+        for line in f:
+            u_id, m_id, rating, ts = line.strip().split(sep)
+            users.append(int(u_id))
+            items.append(movies[m_id])
+            ratings.append(float(rating))
+            timestamps.append(int(ts))
+
+    users = np.frombuffer(users, dtype=np.int32)
+    items = np.frombuffer(items, dtype=np.int32)
+    ratings = np.frombuffer(ratings, dtype=np.float32)
+    timestamps = np.frombuffer(timestamps, dtype=np.int32)
+
+    # 按(用户, 影片)稳定排序,重复的评分只保留文件中最后一条
+    keys = users.astype(np.int64) * len(titles) + items
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    order = order[last]
+
+    for name, column in zip(_COLUMNS, (users, items, ratings, timestamps)):
+        np.save(os.path.join(out, name + '.npy'), column[order])
+    with open(os.path.join(out, 'titles.txt'), 'w') as f:
+        for title in titles:
+            f.write(title + '\n')
+    return out
+
+
+class LazyPrefs(collections.Mapping):
+    """
+    二进制数据上的评分表视图,用法与load_movielens返回的评分表相同.
+    每个用户的 {影片标题: 评分} 字典在访问时才构造,只按LRU缓存最近使用的maxsize个,
+    遍历所有用户时内存不会增长到整个数据集的嵌套字典.
+    """
+    def __init__(self, ratings, maxsize=1024):
+        """
+        :param ratings: BinaryRatings对象
+        :param maxsize: 最多缓存的用户字典个数,为0时不缓存
+        """
+        self._ratings = ratings
+        self.maxsize = maxsize
+        # 有序字典按最近使用的顺序排列,最早的在前
+        self._rows = collections.OrderedDict()
+
+    def __getitem__(self, person):
+        if person in self._rows:
+            row = self._rows.pop(person)
+            self._rows[person] = row
+            return row
+
+        start, end = self._ratings.user_range(person)
+        titles = self._ratings.titles
+        row = dict((titles[i], float(r)) for i, r in
+                   zip(self._ratings.items[start:end], self._ratings.ratings[start:end]))
+        if self.maxsize > 0:
+            self._rows[person] = row
+            if len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+        return row
+
+    def __iter__(self):
+        return iter(self._ratings.user_names)
+
+    def __len__(self):
+        return len(self._ratings.user_names)
+
+    def __contains__(self, person):
+        return person in self._ratings.user_index
+
+
+class BinaryRatings(object):
+    """
+    内存映射加载的二进制评分数据
+    """
+    def __init__(self, path):
+        """
+        :param path: convert_movielens的输出目录
+        """
+        for name in _COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(path, 'titles.txt')) as f:
+            self.titles = [line.rstrip('\n') for line in f]
+
+        # 评分按用户排序,每个用户的评分是一段连续的区间
+        user_ids, starts = np.unique(self.users, return_index=True)
+        self.indptr = np.append(starts, len(self.users))
+        self.user_names = [str(u_id) for u_id in user_ids]
+        self.user_index = dict((name, i) for i, name in enumerate(self.user_names))
+
+    def user_range(self, person):
+        """
+        获取用户评分所在的区间
+        :param person: 用户id字符串
+        :return: 元组(起始位置, 结束位置)
+        """
+        u = self.user_index[person]
+        return self.indptr[u], self.indptr[u + 1]
+
+    def prefs(self, maxsize=1024):
+        """
+        :param maxsize: 评分表视图最多缓存的用户字典个数
+        :return: 按需构造的评分表视图
+        """
+        return LazyPrefs(self, maxsize=maxsize)
+
+    def matrix(self):
+        """
+        直接得到评分矩阵,数据已按用户排序,可以直接作为CSR矩阵的三个数组
+        :return: 评分矩阵
+        """
+        shape = (len(self.user_names), len(self.titles))
+        if sp is not None:
+            values = sp.csr_matrix((self.ratings, self.items, self.indptr), shape=shape)
+            return RatingMatrix(values, self.user_names, self.titles)
+
+        values = np.zeros(shape)
+        mask = np.zeros(shape, dtype=bool)
+        rows = np.repeat(np.arange(shape[0]), np.diff(self.indptr))
+        values[rows, self.items] = self.ratings
+        mask[rows, self.items] = True
+        return RatingMatrix(values, self.user_names, self.titles, mask=mask)
+
+
+def load_movielens_binary(path='data/movielens/binary'):
+    """
+    加载二进制格式的数据集,目录不存在时先从文本数据集转换
+    :param path: 二进制数据目录
+    :return: BinaryRatings对象,可以取得评分表视图prefs()或评分矩阵matrix()
+    """
+    if not os.path.exists(os.path.join(path, 'ratings.npy')):
+        convert_movielens(os.path.dirname(path.rstrip('/')) or '.', out=path)
+    return BinaryRatings(path)
+
+
+if __name__ == '__main__':
+    from recommendations import get_recommendations
+    import time
+
+    start = time.time()
+    data = load_movielens_binary()
+    print '加载二进制MovieLens数据集,用时%.3f秒' % (time.time() - start)
+
+    print '\t依据相似用户给87用户的推荐电影,使用评分表视图'
+    print get_recommendations(data.prefs(), '87', k=30)
+
+    print '\t依据相似用户给87用户的推荐电影,使用评分矩阵'
+    print get_recommendations(data.matrix(), '87', k=30)
@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,相似表的持久化缓存.
+书中提到相似物品表只需计算一次即可多次使用,这里把相似物品表和相似用户表存到磁盘,
+以评分数据的内容哈希, 相似度函数的标识, 相似个数作为键, 评分数据变化时自动失效.
+相似度函数的标识是模块名, 函数名和字节码的哈希;加权等包装对象为类名, __name__(需包括参数)
+和被包装函数的标识.lambda和闭包无法可靠区分,需要通过cache_name参数指定.
+同一目录可以缓存多个数据集,指定dataset时只删除同一数据集过期的缓存.
+
+格式:
+    每张表是缓存目录下的一个子目录,目录名即缓存键,包括
+        neighbours.npy  int32, 每行为相似键在名称表中的位置
+        scores.npy      float64, 与neighbours对应的相似度
+        lengths.npy     int32, 每行的实际长度
+        names.pkl       名称表
+    加载时数组使用内存映射,每个键的相似列表在访问时才构造.
+"""
+
+import collections
+import cPickle as pickle
+import hashlib
+import os
+import shutil
+import tempfile
+import types
+
+import numpy as np
+
+from recommendations import sim_pearson, sim_distance
+from BatchSimilarity import calculate_similar_items_batch, calculate_similar_users_batch
+
+__author__ = 'Guti'
+
+# 缓存格式版本,格式变化时修改,旧的缓存自动失效
+CACHE_VERSION = 3
+
+
+def prefs_digest(prefs):
+    """
+    计算评分表内容的哈希值,与字典的遍历顺序无关
+    :param prefs: 评分表
+    :return: 十六进制字符串
+    """
+    digest = hashlib.sha1()
+    for person in sorted(prefs):
+        digest.update(repr(person))
+        for item, rating in sorted(prefs[person].items()):
+            digest.update('\t%r\t%r' % (item, float(rating)))
+        digest.update('\n')
+    return digest.hexdigest()
+
+
+def similarity_identity(similarity, cache_name=None):
+    """
+    相似度函数在缓存键中的标识
+    :param similarity: 相似度函数或包装对象
+    :param cache_name: 调用方指定的名称,优先使用
+    :return: 字符串,普通函数为'模块.函数名#字节码哈希',
+             包装对象为'模块.类名:__name__',有similarity属性时再加上被包装函数的标识
+    """
+    if cache_name is not None:
+        return cache_name
+    name = getattr(similarity, '__name__', None)
+    if name is None:
+        raise ValueError('相似度函数 %r 没有__name__,请通过cache_name指定缓存名称' % (similarity,))
+    if isinstance(similarity, types.FunctionType):
+        # 不同的lambda同名,闭包的结果还取决于捕获的变量
+        if name == '<lambda>' or similarity.__closure__:
+            raise ValueError('相似度函数 %s 是lambda或闭包,请通过cache_name指定缓存名称' % name)
+        code = similarity.__code__
+        # 嵌套的代码对象repr中有内存地址,不计入
+        consts = [c for c in code.co_consts if not isinstance(c, types.CodeType)]
+        return '%s.%s#%s' % (similarity.__module__, name, _short_hash(code.co_code + repr(consts)))
+    identity = '%s.%s:%s' % (type(similarity).__module__, type(similarity).__name__, name)
+    wrapped = getattr(similarity, 'similarity', None)
+    if wrapped is not None:
+        identity += '[%s]' % similarity_identity(wrapped)
+    return identity
+
+
+def _short_hash(text):
+    return hashlib.sha1(text).hexdigest()[:16]
+
+
+class CachedTable(collections.Mapping):
+    """
+    从缓存加载的相似表,用法与calculate_similar_items返回的相似表相同
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'names.pkl'), 'rb') as f:
+            self.names = pickle.load(f)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.neighbours = np.load(os.path.join(path, 'neighbours.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(path, 'lengths.npy'), mmap_mode='r')
+
+    def __getitem__(self, name):
+        i = self.index[name]
+        return [(float(self.scores[i, j]), self.names[self.neighbours[i, j]]) for j in range(self.lengths[i])]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+def _save_table(table, path):
+    """
+    帮助函数,把相似表写入目录
+    """
+    names = sorted(set(table) | set(other for row in table.values() for _, other in row))
+    index = dict((name, i) for i, name in enumerate(names))
+    width = max([len(row) for row in table.values()] + [0])
+
+    neighbours = np.zeros((len(names), width), dtype=np.int32)
+    scores = np.zeros((len(names), width))
+    lengths = np.zeros(len(names), dtype=np.int32)
+    for name, row in table.items():
+        i = index[name]
+        lengths[i] = len(row)
+        for j, (score, other) in enumerate(row):
+            neighbours[i, j] = index[other]
+            scores[i, j] = score
+
+    np.save(os.path.join(path, 'neighbours.npy'), neighbours)
+    np.save(os.path.join(path, 'scores.npy'), scores)
+    np.save(os.path.join(path, 'lengths.npy'), lengths)
+    with open(os.path.join(path, 'names.pkl'), 'wb') as f:
+        pickle.dump(names, f, pickle.HIGHEST_PROTOCOL)
+
+
+class NeighbourTableCache(object):
+    """
+    相似表的磁盘缓存
+    """
+    def __init__(self, directory='data/cache'):
+        """
+        :param directory: 缓存目录
+        """
+        self.directory = directory
+
+    def _prefix(self, kind, similarity, n, cache_name, dataset):
+        """
+        帮助函数,同一种表的缓存键前缀,同一数据集的评分数据和版本不同的缓存共用前缀
+        """
+        lineage = 'd' + _short_hash(dataset) if dataset is not None else 'anon'
+        return '%s-%s-%s-%d-' % (lineage, kind, _short_hash(similarity_identity(similarity, cache_name)), n)
+
+    def _get(self, kind, prefs, n, similarity, build, cache_name, dataset):
+        """
+        帮助函数,缓存存在时直接加载,否则计算后写入缓存,
+        指定了数据集时删除该数据集同一种表过期的缓存
+        """
+        prefix = self._prefix(kind, similarity, n, cache_name, dataset)
+        key = '%sv%d-%s' % (prefix, CACHE_VERSION, prefs_digest(prefs))
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return CachedTable(path)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        table = build(prefs, n=n, similarity=similarity)
+
+        # 先写入临时目录再重命名,避免中断后留下不完整的缓存
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        try:
+            _save_table(table, tmp)
+            os.rename(tmp, path)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        # 没有指定数据集时无法判断其他缓存是否属于同一数据集,不删除
+        if dataset is not None:
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix) and name != key:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        return CachedTable(path)
+
+    def item_match(self, prefs, n=10, similarity=sim_distance, cache_name=None, dataset=None):
+        """
+        获取相似物品表,可以直接作为get_recommended_items的item_match参数
+        :param prefs: 评分表
+        :param n: 相似个数
+        :param similarity: 相似度计算方法
+        :param cache_name: 相似度函数在缓存键中的名称,默认见similarity_identity
+        :param dataset: 数据集名称,指定时评分数据变化后删除该数据集旧的缓存
+        :return: 相似物品表
+        """
+        return self._get('items', prefs, n, similarity, calculate_similar_items_batch, cache_name, dataset)
+
+    def user_match(self, prefs, n=5, similarity=sim_pearson, cache_name=None, dataset=None):
+        """
+        获取相似用户表
+        :param prefs: 评分表
+        :param n: 相似个数
+        :param similarity: 相似度计算方法
+        :param cache_name: 相似度函数在缓存键中的名称,默认见similarity_identity
+        :param dataset: 数据集名称,指定时评分数据变化后删除该数据集旧的缓存
+        :return: 相似用户表
+        """
+        return self._get('users', prefs, n, similarity, calculate_similar_users_batch, cache_name, dataset)
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens, get_recommended_items
+    import time
+
+    prefs_dict = load_movielens()
+    cache = NeighbourTableCache()
+
+    start = time.time()
+    item_sim = cache.item_match(prefs_dict, n=50, dataset='movielens')
+    print '获取相似物品表,用时%.3f秒,再次运行时直接读取缓存' % (time.time() - start)
+
+    print '\t使用相似物品表给87用户推荐电影'
+    print get_recommended_items(prefs_dict, item_sim, '87', k=30)
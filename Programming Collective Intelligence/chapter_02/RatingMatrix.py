@@ -0,0 +1,360 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,评分矩阵表示.
+把嵌套字典形式的评分表转换为 用户×物品 的评分矩阵(numpy数组或scipy的CSR稀疏矩阵),
+相似度计算一次完成一个用户与所有其他用户的比较.
+
+方法:
+    记评分矩阵为X,评分掩码矩阵为M(有评分处为1,其余为0),目标用户的行向量为x和m,
+    则共有物品上的各项求和都可以写成矩阵与向量的乘积:
+        共有物品个数 n = M·m
+        求和 sum1 = M·x, sum2 = X·m
+        平方和 sum1_sq = M·x², sum2_sq = X²·m
+        乘积和 p_sum = X·x
+    sim_pearson, sim_distance, sim_tanimoto和sim_cosine都只依赖这几项.
+
+转置:
+    CSR矩阵的转置就是以同一组数组表示的CSC矩阵,不需要复制评分.
+    按行取出转置后的一行(即原矩阵的一列)时,使用一个按列排序的置换索引,
+    指向原CSR矩阵的评分数组,所以用户×物品和物品×用户两个方向共用一份评分.
+"""
+
+import heapq
+
+import numpy as np
+
+from recommendations import sim_pearson, sim_distance
+from Tanimoto import sim_tanimoto, sim_cosine
+from SimilarityFormulas import distance_from_sums, pearson_from_sums, tanimoto_from_sums, cosine_from_sums
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+__author__ = 'Guti'
+
+
+def _dot(matrix, vec):
+    """
+    帮助函数,矩阵(稠密或稀疏)与向量的乘积,统一返回一维数组
+    """
+    return np.asarray(matrix.dot(vec)).ravel()
+
+
+def _column_index(indptr, indices, columns):
+    """
+    帮助函数,由CSR矩阵的行结构计算按列访问的置换索引,不复制评分
+    :param indptr: CSR矩阵的行指针
+    :param indices: CSR矩阵的列号
+    :param columns: 列数
+    :return: 元组(列指针, 每个元素的行号, 每个元素在评分数组中的位置),结构与CSC矩阵相同
+    """
+    order = np.argsort(indices, kind='mergesort')
+    col_indptr = np.concatenate(([0], np.cumsum(np.bincount(indices, minlength=columns))))
+    owners = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return col_indptr, owners[order], order
+
+
+class RatingMatrix(object):
+    """
+    用户×物品的评分矩阵.
+    可以像评分表一样按用户取出 {物品: 评分} 字典,
+    top_matches和get_recommendations等函数遇到该对象时会使用向量化的实现.
+    """
+    def __init__(self, values, users, items, mask=None):
+        """
+        :param values: 评分矩阵,numpy数组或scipy稀疏矩阵,没有评分的位置为0.
+        :param users: 行对应的用户列表.
+        :param items: 列对应的物品列表.
+        :param mask: 稠密矩阵的评分掩码,为None时把非0位置视为有评分.
+        """
+        self.users = list(users)
+        self.items = list(items)
+        self.user_index = dict((user, i) for i, user in enumerate(self.users))
+        self.item_index = dict((item, i) for i, item in enumerate(self.items))
+        self.sparse = sp is not None and sp.issparse(values)
+
+        if self.sparse:
+            self.values = values.tocsr().astype(np.float64)
+            self.values.sort_indices()
+            # 稀疏矩阵中存储的位置即为有评分的位置
+            self.mask = self.values.copy()
+            self.mask.data = np.ones_like(self.mask.data)
+            self.squares = self.values.multiply(self.values).tocsr()
+            # 按行和按列访问评分数组的索引,None表示按列的索引还没有计算
+            self._rows = (self.values.indptr, self.values.indices, None)
+            self._columns = None
+        else:
+            self.values = np.asarray(values, dtype=np.float64)
+            if mask is None:
+                mask = self.values != 0
+            self.mask = np.asarray(mask, dtype=np.float64)
+            self.squares = self.values ** 2
+
+    @classmethod
+    def from_prefs(cls, prefs, sparse=True):
+        """
+        由嵌套字典形式的评分表构造评分矩阵
+        :param prefs: 评分表
+        :param sparse: 是否使用CSR稀疏矩阵,scipy不可用时退回稠密数组
+        :return: 评分矩阵
+        """
+        users = sorted(prefs)
+        items = sorted(set(item for user in prefs for item in prefs[user]))
+        item_index = dict((item, i) for i, item in enumerate(items))
+
+        rows, cols, data = list(), list(), list()
+        for i, user in enumerate(users):
+            for item, rating in prefs[user].items():
+                rows.append(i)
+                cols.append(item_index[item])
+                data.append(rating)
+
+        shape = (len(users), len(items))
+        if sparse and sp is not None:
+            values = sp.csr_matrix((data, (rows, cols)), shape=shape, dtype=np.float64)
+            return cls(values, users, items)
+
+        values = np.zeros(shape)
+        mask = np.zeros(shape, dtype=bool)
+        values[rows, cols] = data
+        mask[rows, cols] = True
+        return cls(values, users, items, mask=mask)
+
+    def to_prefs(self):
+        """
+        转换回嵌套字典形式的评分表
+        """
+        return dict((user, self[user]) for user in self.users)
+
+    def transpose(self):
+        """
+        转置评分矩阵,得到 物品×用户 的评分矩阵,用于计算物品相似度.
+        与原矩阵共用评分数组,不复制评分;再次转置得到原来的方向.
+        """
+        result = object.__new__(RatingMatrix)
+        result.users, result.items = self.items, self.users
+        result.user_index, result.item_index = self.item_index, self.user_index
+        result.sparse = self.sparse
+        # 稀疏矩阵的.T是共用数组的CSC矩阵,稠密数组的.T是视图
+        result.values, result.mask, result.squares = self.values.T, self.mask.T, self.squares.T
+        if self.sparse:
+            result._rows, result._columns = self._column_rows(), self._rows
+        return result
+
+    def _column_rows(self):
+        """
+        帮助函数,按列访问评分数组的索引,第一次使用时计算
+        """
+        # 转置得到的矩阵在转置时已经设置,按列访问即为原矩阵按行访问
+        if self._columns is None:
+            indptr, indices, _ = self._rows
+            self._columns = _column_index(indptr, indices, len(self.items))
+        return self._columns
+
+    def _row_entries(self, u):
+        """
+        帮助函数,稀疏矩阵中第u行的列号和评分
+        :return: 元组(列号数组, 评分数组)
+        """
+        indptr, indices, positions = self._rows
+        start, end = indptr[u], indptr[u + 1]
+        if positions is None:
+            return indices[start:end], self.values.data[start:end]
+        return indices[start:end], self.values.data[positions[start:end]]
+
+    def row(self, person):
+        """
+        获取用户的评分行向量和掩码行向量(稠密的一维数组)
+        :param person: 用户
+        :return: 元组(评分向量, 掩码向量)
+        """
+        u = self.user_index[person]
+        if self.sparse:
+            columns, ratings = self._row_entries(u)
+            x, m = np.zeros(len(self.items)), np.zeros(len(self.items))
+            x[columns] = ratings
+            m[columns] = 1
+            return x, m
+        return self.values[u], self.mask[u]
+
+    def __getitem__(self, person):
+        u = self.user_index[person]
+        if self.sparse:
+            columns, ratings = self._row_entries(u)
+            return dict((self.items[j], float(r)) for j, r in zip(columns, ratings))
+        return dict((self.items[j], float(self.values[u, j])) for j in np.flatnonzero(self.mask[u]))
+
+    def __contains__(self, person):
+        return person in self.user_index
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def similarities(self, person, similarity=sim_pearson):
+        """
+        计算一个用户与所有用户的相似度
+        :param person: 待计算的用户
+        :param similarity: 相似度计算方法,可以是向量化函数,也可以是sim_pearson等逐对计算的函数
+        :return: 与self.users对应的相似度数组
+        """
+        kernel = _kernel(similarity)
+        if kernel is not None:
+            return kernel(self, person)
+        # 没有向量化实现的相似度函数,逐个用户计算
+        return np.array([similarity(self, person, other) for other in self.users], dtype=np.float64)
+
+    def top_matches(self, person, n=5, similarity=sim_pearson):
+        """
+        与recommendations.top_matches相同,一次计算所有用户的相似度
+        """
+        scores = self.similarities(person, similarity)
+        u = self.user_index[person]
+        ranked = ((float(scores[i]), other) for i, other in enumerate(self.users) if i != u)
+        return heapq.nlargest(n, ranked)
+
+    def recommendation_scores(self, person, similarity=sim_pearson):
+        """
+        与recommendations.get_recommendations相同但不排序,评分权重和相似度之和都由矩阵乘积得到
+        """
+        sims = self.similarities(person, similarity)
+        # 不计算与自身的相似度,相似度小于等于0忽略
+        sims[self.user_index[person]] = 0
+        sims[sims < 0] = 0
+
+        totals = _dot(self.values.T, sims)
+        sim_sums = _dot(self.mask.T, sims)
+
+        # 只推荐用户没有评分(或评分为0)而相似用户评过分的物品
+        own, _ = self.row(person)
+        candidates = np.flatnonzero((sim_sums > 0) & (own == 0))
+        return [(float(totals[j] / sim_sums[j]), self.items[j]) for j in candidates]
+
+
+def _co_rated_sums(matrix, person):
+    """
+    帮助函数,计算一个用户与所有用户在共有物品上的各项求和
+    :param matrix: 评分矩阵
+    :param person: 待计算的用户
+    :return: 元组(共有个数, 求和, 求和, 平方和, 平方和, 乘积和),
+             每一项都是与matrix.users对应的数组,前一项是person的,后一项是其他用户的
+    """
+    x, m = matrix.row(person)
+    n = _dot(matrix.mask, m)
+    sum1 = _dot(matrix.mask, x)
+    sum2 = _dot(matrix.values, m)
+    sum1_sq = _dot(matrix.mask, x ** 2)
+    sum2_sq = _dot(matrix.squares, m)
+    p_sum = _dot(matrix.values, x)
+    return n, sum1, sum2, sum1_sq, sum2_sq, p_sum
+
+
+def vec_sim_distance(matrix, person):
+    """
+    向量化的欧几里得距离评价,对应sim_distance
+    :param matrix: 评分矩阵
+    :param person: 待计算的用户
+    :return: 与所有用户的相似度数组
+    """
+    return distance_from_sums(*_co_rated_sums(matrix, person))
+
+
+def vec_sim_pearson(matrix, person):
+    """
+    向量化的皮尔逊相关系数,对应sim_pearson
+    :param matrix: 评分矩阵
+    :param person: 待计算的用户
+    :return: 与所有用户的相似度数组
+    """
+    return pearson_from_sums(*_co_rated_sums(matrix, person))
+
+
+def vec_sim_tanimoto(matrix, person):
+    """
+    向量化的谷本相关系数,对应sim_tanimoto
+    :param matrix: 评分矩阵
+    :param person: 待计算的用户
+    :return: 与所有用户的相似度数组
+    """
+    return tanimoto_from_sums(*_co_rated_sums(matrix, person))
+
+
+def vec_sim_cosine(matrix, person):
+    """
+    向量化的余弦相似度,对应sim_cosine
+    :param matrix: 评分矩阵
+    :param person: 待计算的用户
+    :return: 与所有用户的相似度数组
+    """
+    return cosine_from_sums(*_co_rated_sums(matrix, person))
+
+
+# 逐对计算的相似度函数与向量化实现的对应关系
+_KERNELS = {
+    sim_distance: vec_sim_distance,
+    sim_pearson: vec_sim_pearson,
+    sim_tanimoto: vec_sim_tanimoto,
+    sim_cosine: vec_sim_cosine,
+}
+
+# 向量化实现与求和公式的对应关系
+_FORMULAS = {
+    vec_sim_distance: distance_from_sums,
+    vec_sim_pearson: pearson_from_sums,
+    vec_sim_tanimoto: tanimoto_from_sums,
+    vec_sim_cosine: cosine_from_sums,
+}
+
+
+def _kernel(similarity):
+    """
+    帮助函数,查找相似度函数的向量化实现,没有则返回None
+    """
+    # 自带向量化实现的相似度对象,如WeightedSimilarity中的加权相似度
+    if hasattr(similarity, 'matrix_kernel'):
+        return similarity.matrix_kernel
+    if similarity in _FORMULAS:
+        return similarity
+    return _KERNELS.get(similarity)
+
+
+def register_kernel(similarity, kernel):
+    """
+    注册逐对相似度函数的向量化实现,之后评分矩阵上的top_matches等函数会使用它
+    :param similarity: 逐对计算的相似度函数
+    :param kernel: 以(评分矩阵, 用户)为参数,返回与所有用户相似度数组的函数
+    """
+    _KERNELS[similarity] = kernel
+
+
+def sums_formula(similarity):
+    """
+    查找相似度函数对应的求和公式,没有则返回None
+    :param similarity: 逐对计算的相似度函数或其向量化实现
+    :return: 以(共有个数, 求和, 求和, 平方和, 平方和, 乘积和)为参数的函数
+    """
+    return _FORMULAS.get(_kernel(similarity))
+
+
+if __name__ == '__main__':
+    from recommendations import critics, load_movielens, top_matches, get_recommendations
+    import time
+
+    critics_matrix = RatingMatrix.from_prefs(critics)
+
+    print '与 Toby 最相似的3个人,使用评分矩阵'
+    print top_matches(critics_matrix, 'Toby', n=3)
+
+    print '\n给 Toby 推荐电影,使用评分矩阵和谷本相似度评价'
+    print get_recommendations(critics_matrix, 'Toby', similarity=sim_tanimoto)
+
+    print '\n使用MovieLens数据集:'
+    movielens_matrix = RatingMatrix.from_prefs(load_movielens())
+    start = time.time()
+    recommendations = get_recommendations(movielens_matrix, '87', k=30)
+    print '\t依据相似用户给87用户的推荐电影,用时%.3f秒' % (time.time() - start)
+    print recommendations
@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,分块流式读取评分文件.
+load_movielens要把整个文件读成嵌套字典之后才能计算,评分日志超过内存时无法使用.
+这里按固定大小的块逐块产生评分记录,各个统计阶段逐块消费,不保留原始记录.
+
+方法:
+    按用户求和, 按物品计数只需一次遍历.
+    配对统计量(共有个数, 求和, 平方和, 乘积和)需要同一物品(或用户)的全部评分,
+    先按物品(或用户)的哈希把记录分散写入若干临时文件,再逐个文件分组累加,
+    每次只需把一个分区读入内存.
+"""
+
+import heapq
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from recommendations import sim_pearson
+from IncrementalSimilarity import STAT_FORMULAS
+
+__author__ = 'Guti'
+
+
+def iter_rating_chunks(filename, chunk_size=10000, sep='\t', items=None):
+    """
+    分块读取评分文件
+    :param filename: 评分文件,每行为 用户, 物品, 评分, 时间戳
+    :param chunk_size: 每块的记录数
+    :param sep: 分隔符
+    :param items: 物品id到名称的映射,为None时使用原始id
+    :return: 生成器,每次产生一个由(用户, 物品, 评分, 时间戳)组成的列表
+    """
+    chunk = list()
+    with open(filename) as f:
+        for line in f:
+            user, item, rating, ts = line.strip().split(sep)
+            if items is not None:
+                item = items[item]
+            chunk.append((user, item, float(rating), int(ts)))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = list()
+    if chunk:
+        yield chunk
+
+
+def load_titles(path='data/movielens'):
+    """
+    读取MovieLens影片id到标题的映射,可以作为iter_rating_chunks的items参数
+    """
+    movies = dict()
+    with open(path + '/u.item') as f:
+        for line in f:
+            m_id, title = line.split('|')[:2]
+            movies[m_id] = title
+    return movies
+
+
+def user_sums(chunks):
+    """
+    统计每个用户的评分个数, 求和, 平方和
+    :param chunks: iter_rating_chunks产生的记录块
+    :return: 字典,用户到列表[个数, 求和, 平方和]
+    """
+    result = dict()
+    for chunk in chunks:
+        for user, item, rating, ts in chunk:
+            stats = result.setdefault(user, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += rating
+            stats[2] += rating * rating
+    return result
+
+
+def item_counts(chunks):
+    """
+    统计每个物品的评分个数
+    :param chunks: iter_rating_chunks产生的记录块
+    :return: 字典,物品到评分个数
+    """
+    result = dict()
+    for chunk in chunks:
+        for user, item, rating, ts in chunk:
+            result[item] = result.get(item, 0) + 1
+    return result
+
+
+def _spill(chunks, by, partitions, directory):
+    """
+    帮助函数,把记录按共有属性的哈希写入分区文件
+    :return: 分区文件路径的列表
+    """
+    paths = [os.path.join(directory, 'part-%d' % i) for i in range(partitions)]
+    files = [open(path, 'w') for path in paths]
+    try:
+        for chunk in chunks:
+            for user, item, rating, ts in chunk:
+                key, attr = (user, item) if by == 'users' else (item, user)
+                files[hash(attr) % partitions].write('%s\t%s\t%r\n' % (key, attr, rating))
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def pair_statistics(chunks, by='users', partitions=16, tmpdir=None):
+    """
+    计算所有配对在共有属性上的统计量,与IncrementalNeighbours记录的相同
+    :param chunks: iter_rating_chunks产生的记录块
+    :param by: 'users'时计算用户配对,'items'时计算物品配对
+    :param partitions: 分区个数,越多每次读入内存的记录越少
+    :param tmpdir: 临时文件目录
+    :return: 字典,配对(较小的键, 较大的键)到列表[共有个数, 求和, 求和, 平方和, 平方和, 乘积和]
+    """
+    if by not in ('users', 'items'):
+        raise ValueError("by must be 'users' or 'items'")
+    directory = tempfile.mkdtemp(dir=tmpdir)
+    result = dict()
+    try:
+        for path in _spill(chunks, by, partitions, directory):
+            # 一个分区中同一共有属性的评分全部在一起,同一键的重复评分保留最后一条
+            groups = dict()
+            with open(path) as f:
+                for line in f:
+                    key, attr, rating = line.rstrip('\n').split('\t')
+                    groups.setdefault(attr, {})[key] = float(rating)
+
+            for raters in groups.itervalues():
+                raters = sorted(raters.items())
+                for i in range(len(raters)):
+                    a, r1 = raters[i]
+                    for b, r2 in raters[i + 1:]:
+                        stats = result.get((a, b))
+                        if stats is None:
+                            stats = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+                            result[(a, b)] = stats
+                        stats[0] += 1
+                        stats[1] += r1
+                        stats[2] += r2
+                        stats[3] += r1 * r1
+                        stats[4] += r2 * r2
+                        stats[5] += r1 * r2
+            os.remove(path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def neighbours_from_statistics(stats, n=5, similarity=sim_pearson):
+    """
+    由配对统计量得到相似表,没有共有属性的配对不出现在相似列表中
+    :param stats: pair_statistics的结果
+    :param n: 相似个数
+    :param similarity: 相似度计算方法,支持sim_pearson, sim_distance, sim_tanimoto, sim_cosine
+    :return: 相似表
+    """
+    formula = STAT_FORMULAS[similarity]
+    pairs = stats.keys()
+    # 所有配对的统计量组成数组,两个方向各用公式计算一次
+    columns = np.array([stats[pair] for pair in pairs], dtype=np.float64).reshape(-1, 6).T
+    count, sum1, sum2, sum1_sq, sum2_sq, p_sum = columns
+    forward = formula(count, sum1, sum2, sum1_sq, sum2_sq, p_sum).tolist()
+    backward = formula(count, sum2, sum1, sum2_sq, sum1_sq, p_sum).tolist()
+    scores = dict()
+    for (a, b), score_ab, score_ba in zip(pairs, forward, backward):
+        scores.setdefault(a, []).append((score_ab, b))
+        scores.setdefault(b, []).append((score_ba, a))
+    return dict((key, heapq.nlargest(n, entries)) for key, entries in scores.iteritems())
+
+
+if __name__ == '__main__':
+    from recommendations import sim_distance
+
+    data_file = 'data/movielens/u.data'
+    titles = load_titles()
+
+    print '流式统计每个用户的评分个数和平均分'
+    sums = user_sums(iter_rating_chunks(data_file))
+    print '87用户: %d 条评分, 平均 %.2f 分' % (sums['87'][0], sums['87'][1] / sums['87'][0])
+
+    print '\n流式计算相似用户表'
+    user_stats = pair_statistics(iter_rating_chunks(data_file), by='users')
+    print neighbours_from_statistics(user_stats)['87']
+
+    print '\n流式计算相似物品表'
+    item_stats = pair_statistics(iter_rating_chunks(data_file, items=titles), by='items')
+    print neighbours_from_statistics(item_stats, n=10, similarity=sim_distance)['Star Wars (1977)']
@@ -0,0 +1,354 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,本地推荐服务.
+把get_recommendations和get_recommended_items包装为本地HTTP服务,
+热门用户的相同请求同时到达时只计算一次.
+
+方法:
+    每个请求由一个线程处理,计算交给进程池,评分表由进程池的initializer交给每个子进程,
+    fork时直接继承,不需要序列化;数据属于服务对象,同一进程中可以有多个服务.
+    正在计算的请求以(接口, 用户, 参数)为键记录,相同的请求到达时直接等待同一个结果(请求合并),
+    计算完成时通过threading.Event唤醒所有等待的请求.
+    每个请求有截止时间,超时返回504,计算结果仍会交给其他等待的请求.
+    计算失败时返回500,失败的结果不会留给之后相同的请求.
+    load_test是配套的本地压测工具,统计p50/p99延迟.
+
+注意:
+    代码基于Python 2,没有asyncio,这里用线程和进程池实现同样的合并, 卸载和超时.
+
+接口:
+    GET /recommendations?user=87&k=30&similarity=sim_pearson
+    GET /items?user=87&k=30
+    返回JSON列表,每一项为[估算评分, 物品]
+"""
+
+import BaseHTTPServer
+import SocketServer
+import httplib
+import json
+import multiprocessing
+import threading
+import time
+import urlparse
+
+from recommendations import (sim_pearson, sim_distance, get_recommendations, get_recommended_items,
+                             _transform_prefs)
+
+__author__ = 'Guti'
+
+# 可以通过参数选择的相似度函数
+SIMILARITIES = {
+    'sim_pearson': sim_pearson,
+    'sim_distance': sim_distance,
+}
+
+# 子进程中的数据,由进程池的initializer设置,只在子进程中使用
+_worker_prefs = None
+_worker_item_prefs = None
+_worker_item_match = None
+
+# 等待结果时检查进程池状态的间隔,单位秒
+_POLL_INTERVAL = 0.5
+
+
+def _init_worker(prefs, item_prefs, item_match):
+    """
+    帮助函数,进程池的initializer,在每个子进程中保存服务的数据
+    """
+    global _worker_prefs, _worker_item_prefs, _worker_item_match
+    _worker_prefs = prefs
+    _worker_item_prefs = item_prefs
+    _worker_item_match = item_match
+
+
+def _recommend(user, similarity, k):
+    """
+    帮助函数,在子进程中基于用户推荐
+    """
+    return get_recommendations(_worker_prefs, user, similarity=SIMILARITIES[similarity],
+                               item_prefs=_worker_item_prefs, k=k)
+
+
+def _recommend_items(user, k):
+    """
+    帮助函数,在子进程中基于物品推荐
+    """
+    return get_recommended_items(_worker_prefs, _worker_item_match, user, k=k)
+
+
+def _guarded(func, args):
+    """
+    帮助函数,在子进程中调用func并捕获异常,使进程池的回调在失败时也会执行
+    :return: 元组(是否成功, 结果或错误信息)
+    """
+    try:
+        return True, func(*args)
+    except Exception as e:
+        return False, '%s: %s' % (type(e).__name__, e)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    HTTP请求处理,解析参数后交给RecommendationService
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        try:
+            status, body = self.server.service.handle(url.path, params)
+        except Exception as e:
+            # 出错时仍然返回状态行,不直接断开连接
+            status, body = 500, {'error': '%s: %s' % (type(e).__name__, e)}
+        data = json.dumps(body, encoding=self.server.service.encoding)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 压测时不输出每个请求的日志
+        pass
+
+
+class _Pending(object):
+    """
+    一次正在进行的计算,合并的请求共用它等待结果.
+    AsyncResult完成时只唤醒一个等待者,这里由回调设置Event,唤醒所有等待者
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.async_result = None
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class RecommendationService(object):
+    """
+    带请求合并和截止时间的推荐服务
+    """
+    def __init__(self, prefs, item_match=None, workers=2, deadline=5.0,
+                 host='127.0.0.1', port=8000, encoding='utf-8'):
+        """
+        :param prefs: 评分表
+        :param item_match: 相似物品表,为None时不提供/items接口
+        :param workers: 计算进程数
+        :param deadline: 每个请求的截止时间,单位秒,None表示不限
+        :param host: 监听地址
+        :param port: 监听端口,为0时自动选择
+        :param encoding: 物品名称的编码,MovieLens的标题为latin-1
+        """
+        self.prefs = prefs
+        self.item_match = item_match
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                         initargs=(prefs, _transform_prefs(prefs), item_match))
+
+        self.deadline = deadline
+        self.encoding = encoding
+        self.requests = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._in_flight = dict()
+
+        self.server = _Server((host, port), _Handler)
+        self.server.service = self
+        self.address = self.server.server_address
+        self._thread = None
+
+    def _submit(self, key, func, args):
+        """
+        帮助函数,提交计算;相同的请求正在计算时返回同一个_Pending
+        """
+        with self._lock:
+            self.requests += 1
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                self.coalesced += 1
+                return pending
+
+            pending = _Pending()
+
+            def done(value):
+                self._forget(key, pending)
+                pending.value = value
+                pending.event.set()
+            pending.async_result = self.pool.apply_async(_guarded, (func, args), callback=done)
+            self._in_flight[key] = pending
+            return pending
+
+    def _forget(self, key, pending):
+        """
+        帮助函数,计算结束后移除正在计算的记录,记录已被新的计算替换时不移除
+        """
+        with self._lock:
+            if self._in_flight.get(key) is pending:
+                del self._in_flight[key]
+
+    def _wait(self, pending):
+        """
+        帮助函数,等待计算结束,进程池本身出错时没有回调,定期检查AsyncResult
+        :return: 截止时间前结束时为True
+        """
+        end = None if self.deadline is None else time.time() + self.deadline
+        while not pending.event.is_set() and not pending.async_result.ready():
+            timeout = _POLL_INTERVAL
+            if end is not None:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                timeout = min(timeout, remaining)
+            pending.event.wait(timeout)
+        return True
+
+    def handle(self, path, params):
+        """
+        处理一个请求
+        :param path: 接口路径
+        :param params: 查询参数字典
+        :return: 元组(HTTP状态码, 可序列化为JSON的结果)
+        """
+        user = params.get('user')
+        try:
+            k = int(params.get('k', 30))
+        except ValueError:
+            k = 0
+        if k < 1:
+            return 400, {'error': 'k must be a positive integer'}
+        if user is None or user not in self.prefs:
+            return 404, {'error': 'unknown user'}
+
+        if path == '/recommendations':
+            similarity = params.get('similarity', 'sim_pearson')
+            if similarity not in SIMILARITIES:
+                return 400, {'error': 'unknown similarity'}
+            key = (path, user, similarity, k)
+            pending = self._submit(key, _recommend, (user, similarity, k))
+        elif path == '/items' and self.item_match is not None:
+            key = (path, user, k)
+            pending = self._submit(key, _recommend_items, (user, k))
+        else:
+            return 404, {'error': 'unknown path'}
+
+        if not self._wait(pending):
+            with self._lock:
+                self.timeouts += 1
+            return 504, {'error': 'deadline exceeded'}
+        if not pending.event.is_set():
+            # 进程池本身的错误,如参数无法序列化,回调不会执行
+            self._forget(key, pending)
+            with self._lock:
+                self.errors += 1
+            try:
+                pending.async_result.get(0)
+                error = 'no result'
+            except Exception as e:
+                error = '%s: %s' % (type(e).__name__, e)
+            return 500, {'error': error}
+        ok, value = pending.value
+        if not ok:
+            with self._lock:
+                self.errors += 1
+            return 500, {'error': value}
+        return 200, value
+
+    def start(self):
+        """
+        在后台线程中启动服务
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        """
+        停止服务并关闭进程池
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.close()
+        self.pool.join()
+
+
+def _percentile(values, fraction):
+    """
+    帮助函数,计算已排序列表的分位数
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_test(host, port, paths, concurrency=8, requests=200):
+    """
+    本地压测,多个线程并发地循环请求给定的路径
+    :param host: 服务地址
+    :param port: 服务端口
+    :param paths: 请求路径的列表,按顺序循环使用
+    :param concurrency: 并发线程数
+    :param requests: 总请求数
+    :return: 字典,包括p50, p99, 平均延迟(秒), 每秒请求数和各状态码的个数
+    """
+    latencies = list()
+    statuses = dict()
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        connection = httplib.HTTPConnection(host, port)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.time()
+            connection.request('GET', paths[i % len(paths)])
+            response = connection.getresponse()
+            response.read()
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+        connection.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.time() - start
+
+    latencies.sort()
+    return {'p50': _percentile(latencies, .5),
+            'p99': _percentile(latencies, .99),
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'throughput': len(latencies) / total if total > 0 else float('inf'),
+            'statuses': statuses}
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens
+
+    prefs_dict = load_movielens()
+    service = RecommendationService(prefs_dict, workers=multiprocessing.cpu_count(),
+                                    port=0, encoding='latin-1').start()
+    service_host, service_port = service.address
+    print '推荐服务已启动: http://%s:%d' % (service_host, service_port)
+
+    print '\n压测: 热门用户87的相同请求'
+    print load_test(service_host, service_port, ['/recommendations?user=87&k=30'], concurrency=16, requests=200)
+    print '请求 %d 个, 合并 %d 个, 超时 %d 个, 失败 %d 个' % (
+        service.requests, service.coalesced, service.timeouts, service.errors)
+
+    print '\n压测: 不同用户的请求'
+    users_paths = ['/recommendations?user=%s&k=30' % user for user in sorted(prefs_dict)[:50]]
+    print load_test(service_host, service_port, users_paths, concurrency=16, requests=200)
+
+    service.shutdown()
@@ -0,0 +1,58 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,由共有物品上的各项求和计算相似度的公式.
+sim_pearson, sim_distance, sim_tanimoto和sim_cosine都只依赖两者共有物品上的
+共有个数n, 求和sum1和sum2, 平方和sum1_sq和sum2_sq, 乘积和p_sum.
+RatingMatrix的向量化实现, IncrementalSimilarity的增量统计量, RatingStream的配对统计量
+和Tanimoto的稀疏向量都使用这里的公式,参数可以是数值或任意形状的数组.
+
+这里只依赖numpy,RatingMatrix和Tanimoto都可以导入而不会循环导入.
+"""
+
+import numpy as np
+
+__author__ = 'Guti'
+
+
+def _as_float(value):
+    return np.asarray(value, dtype=np.float64)
+
+
+def distance_from_sums(n, sum1, sum2, sum1_sq, sum2_sq, p_sum):
+    """
+    由共有物品上的各项求和计算欧几里得距离评价,与sim_distance相同
+    """
+    # 差的平方和展开为 sum1_sq + sum2_sq - 2*p_sum,浮点误差可能产生极小的负数
+    sum_of_squares = np.maximum(_as_float(sum1_sq) + sum2_sq - 2 * p_sum, 0)
+    return np.where(_as_float(n) > 0, 1 / (1 + np.sqrt(sum_of_squares)), 0.0)
+
+
+def pearson_from_sums(n, sum1, sum2, sum1_sq, sum2_sq, p_sum):
+    """
+    由共有物品上的各项求和计算皮尔逊相关系数,与sim_pearson相同
+    """
+    n = _as_float(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num = p_sum - (sum1 * sum2) / n
+        den = np.sqrt(np.maximum((sum1_sq - sum1 ** 2 / n) * (sum2_sq - sum2 ** 2 / n), 0))
+        return np.where((n > 0) & (den > 0), num / den, 0.0)
+
+
+def tanimoto_from_sums(n, sum1, sum2, sum1_sq, sum2_sq, p_sum):
+    """
+    由共有物品上的各项求和计算谷本相关系数,与sim_tanimoto相同
+    """
+    p_sum = _as_float(p_sum)
+    den = sum1_sq + sum2_sq - p_sum
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((_as_float(n) > 0) & (den != 0), p_sum / den, 0.0)
+
+
+def cosine_from_sums(n, sum1, sum2, sum1_sq, sum2_sq, p_sum):
+    """
+    由共有物品上的各项求和计算余弦相似度,与sim_cosine相同
+    """
+    p_sum = _as_float(p_sum)
+    den = np.sqrt(_as_float(sum1_sq) * sum2_sq)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((_as_float(n) > 0) & (den != 0), p_sum / den, 0.0)
@@ -6,50 +6,62 @@
     谷本相似度评价在只有0和1值时，和有非bit值时的计算公式是统一的
     这里由于是使用了非bit值，所以需要使用点积来计算
     具体链接: https://en.wikipedia.org/wiki/Jaccard_index
+
+加速：
+    sim_tanimoto和sim_cosine只遍历一次较短的评分字典，同时累加平方和与点积
+    SparseVectors把评分存为排序的物品编号数组，两人之间合并编号数组，一人与所有人之间批量累加
+    BitsetIndex用于0/1评分，按位与后查表计数(popcount)得到谷本系数
 """
 
-__author__ = 'guti'
+import heapq
+from math import sqrt
 
+import numpy as np
 
-def _items_in_both(prefs, person1, person2):
-    """
-    帮助函数，获取共有属性的列表
-    """
-    return [item for item in prefs[person1] if item in prefs[person2]]
+from SimilarityFormulas import tanimoto_from_sums, cosine_from_sums
+
+__author__ = 'guti'
 
 
-def _square_and_dot(prefs, person1, person2, si):
+def _pair_sums(prefs, person1, person2):
     """
-    帮助函数，获取共有属性的列表
+    帮助函数，只遍历一次较短的评分字典，同时得到共有个数、平方和与点积
     :param prefs: 评分表
     :param person1: 评分表中人
     :param person2: 评分表中人
-    :param si: 共有属性列表
-    :return: 元组(平方和， 平方和， 点积)
+    :return: 元组(共有个数， 平方和， 平方和， 点积)
     """
-    # 求平方和
-    sum1_sq = sum([pow(prefs[person1][item], 2) for item in si])
-    sum2_sq = sum([pow(prefs[person2][item], 2) for item in si])
+    ratings1, ratings2 = prefs[person1], prefs[person2]
+    swapped = len(ratings2) < len(ratings1)
+    if swapped:
+        ratings1, ratings2 = ratings2, ratings1
 
-    # 求乘积和
-    p_sum = sum([prefs[person1][item] * prefs[person2][item] for item in si])
+    n = 0
+    sum1_sq = sum2_sq = p_sum = 0.0
+    for item, r1 in ratings1.iteritems():
+        r2 = ratings2.get(item)
+        if r2 is None:
+            continue
+        n += 1
+        sum1_sq += r1 * r1
+        sum2_sq += r2 * r2
+        p_sum += r1 * r2
 
-    return sum1_sq, sum2_sq, p_sum
+    if swapped:
+        sum1_sq, sum2_sq = sum2_sq, sum1_sq
+    return n, sum1_sq, sum2_sq, p_sum
 
 
 def sim_tanimoto(prefs, person1, person2):
     """
     谷本相关系数计算
     """
-    # 相似列表
-    si = _items_in_both(prefs, person1, person2)
+    n, sum1_sq, sum2_sq, p_sum = _pair_sums(prefs, person1, person2)
 
     # 完全没有相似的电影
-    if len(si) == 0:
+    if n == 0:
         return 0
 
-    sum1_sq, sum2_sq, p_sum = _square_and_dot(prefs, person1, person2, si)
-
     return p_sum / (sum1_sq + sum2_sq - p_sum)
 
 
@@ -57,16 +69,206 @@ def sim_cosine(prefs, person1, person2):
     """
     余弦相似度计算
     """
-    # 相似列表
-    si = _items_in_both(prefs, person1, person2)
+    n, sum1_sq, sum2_sq, p_sum = _pair_sums(prefs, person1, person2)
 
     # 完全没有相似的电影
-    if len(si) == 0:
+    if n == 0:
         return 0
 
-    sum1_sq, sum2_sq, p_sum = _square_and_dot(prefs, person1, person2, si)
+    return p_sum / sqrt(sum1_sq * sum2_sq)
+
+
+# 稀疏向量可以批量计算的相似度，公式与RatingMatrix共用
+_BATCH_FORMULAS = {
+    sim_tanimoto: tanimoto_from_sums,
+    sim_cosine: cosine_from_sums,
+}
+
+
+class SparseVectors(object):
+    """
+    稀疏向量形式的评分表，每个人的评分为按物品编号排序的(编号数组， 评分数组)
+    可以像评分表一样按人取出 {物品: 评分} 字典，top_matches遇到该对象时批量计算
+    """
+    def __init__(self, prefs):
+        """
+        :param prefs: 评分表
+        """
+        self.users = sorted(prefs)
+        self.items = sorted(set(item for person in prefs for item in prefs[person]))
+        self.user_index = dict((person, u) for u, person in enumerate(self.users))
+        self.item_index = dict((item, i) for i, item in enumerate(self.items))
+
+        indptr, indices, data = [0], list(), list()
+        for person in self.users:
+            row = sorted((self.item_index[item], rating) for item, rating in prefs[person].items())
+            indices.extend(i for i, _ in row)
+            data.extend(r for _, r in row)
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.data = np.array(data, dtype=np.float64)
+        # 每个评分属于第几个人，用于批量计算时按人求和
+        self.owners = np.repeat(np.arange(len(self.users)), np.diff(self.indptr))
+
+    def _row(self, person):
+        """
+        帮助函数，一个人的物品编号数组和评分数组
+        """
+        u = self.user_index[person]
+        start, end = self.indptr[u], self.indptr[u + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def __getitem__(self, person):
+        indices, data = self._row(person)
+        return dict((self.items[i], r) for i, r in zip(indices.tolist(), data.tolist()))
+
+    def __contains__(self, person):
+        return person in self.user_index
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
 
-    return p_sum / sum1_sq + sum2_sq
+    def sums(self, person1, person2):
+        """
+        合并两个人排序后的物品编号数组，得到共有物品上的各项求和
+        较短的数组在较长的数组中二分查找，numpy一次完成
+        :return: 元组(共有个数， 求和， 求和， 平方和， 平方和， 点积)，与SimilarityFormulas的参数相同
+        """
+        indices1, data1 = self._row(person1)
+        indices2, data2 = self._row(person2)
+        swapped = len(indices2) < len(indices1)
+        if swapped:
+            indices1, data1, indices2, data2 = indices2, data2, indices1, data1
+        if len(indices1) == 0 or len(indices2) == 0:
+            return 0, 0.0, 0.0, 0.0, 0.0, 0.0
+
+        positions = np.minimum(np.searchsorted(indices2, indices1), len(indices2) - 1)
+        shared = indices2[positions] == indices1
+        r1, r2 = data1[shared], data2[positions[shared]]
+        sum1, sum2 = float(r1.sum()), float(r2.sum())
+        sum1_sq, sum2_sq = float(r1.dot(r1)), float(r2.dot(r2))
+        if swapped:
+            sum1, sum2, sum1_sq, sum2_sq = sum2, sum1, sum2_sq, sum1_sq
+        return int(shared.sum()), sum1, sum2, sum1_sq, sum2_sq, float(r1.dot(r2))
+
+    def tanimoto(self, person1, person2):
+        """
+        与sim_tanimoto相同
+        """
+        return float(tanimoto_from_sums(*self.sums(person1, person2)))
+
+    def cosine(self, person1, person2):
+        """
+        与sim_cosine相同
+        """
+        return float(cosine_from_sums(*self.sums(person1, person2)))
+
+    def batch_sums(self, person):
+        """
+        批量模式，一个人与所有人在共有物品上的各项求和
+        把这个人的评分展开为稠密向量，按编号取出每条评分对应的值，再按人累加
+        :return: 元组(共有个数， 求和， 求和， 平方和， 平方和， 点积)，每一项都是与self.users对应的数组
+        """
+        indices, data = self._row(person)
+        x = np.zeros(len(self.items))
+        m = np.zeros(len(self.items))
+        x[indices] = data
+        m[indices] = 1
+
+        xv, mv = x[self.indices], m[self.indices]
+        size = len(self.users)
+        n = np.bincount(self.owners, weights=mv, minlength=size)
+        sum1 = np.bincount(self.owners, weights=xv, minlength=size)
+        sum2 = np.bincount(self.owners, weights=self.data * mv, minlength=size)
+        sum1_sq = np.bincount(self.owners, weights=xv * xv, minlength=size)
+        sum2_sq = np.bincount(self.owners, weights=self.data * self.data * mv, minlength=size)
+        p_sum = np.bincount(self.owners, weights=self.data * xv, minlength=size)
+        return n, sum1, sum2, sum1_sq, sum2_sq, p_sum
+
+    def similarities(self, person, similarity=sim_tanimoto):
+        """
+        一个人与所有人的相似度
+        :param person: 待计算的人
+        :param similarity: 相似度函数，sim_tanimoto和sim_cosine批量计算，其余逐个计算
+        :return: 与self.users对应的相似度数组
+        """
+        formula = _BATCH_FORMULAS.get(similarity)
+        if formula is not None:
+            return formula(*self.batch_sums(person))
+        return np.array([similarity(self, person, other) for other in self.users], dtype=np.float64)
+
+    def top_matches(self, person, n=5, similarity=sim_tanimoto):
+        """
+        与recommendations.top_matches相同，一次计算所有人的相似度
+        """
+        scores = self.similarities(person, similarity)
+        u = self.user_index[person]
+        ranked = ((float(scores[i]), other) for i, other in enumerate(self.users) if i != u)
+        return heapq.nlargest(n, ranked)
+
+
+# 0-255每个字节中1的个数
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+class BitsetIndex(object):
+    """
+    0/1评分(是否评过分)的位集合，谷本系数即两个集合的Jaccard系数:
+        交集个数 / (个数1 + 个数2 - 交集个数)
+    交集由按位与得到，个数由查表的popcount得到
+    """
+    def __init__(self, prefs):
+        """
+        :param prefs: 评分表，只使用是否评过分
+        """
+        self.users = sorted(prefs)
+        self.items = sorted(set(item for person in prefs for item in prefs[person]))
+        self.user_index = dict((person, u) for u, person in enumerate(self.users))
+        item_index = dict((item, i) for i, item in enumerate(self.items))
+
+        # 每行是字节数组，8个物品一个字节，直接置位而不生成用户×物品的矩阵
+        # 位序与np.packbits相同：物品j在第j >> 3个字节的高位起第j & 7位
+        self.packed = np.zeros((len(self.users), (len(self.items) + 7) >> 3), dtype=np.uint8)
+        self.counts = np.zeros(len(self.users), dtype=np.int64)
+        for u, person in enumerate(self.users):
+            j = np.array([item_index[item] for item in prefs[person]], dtype=np.int64)
+            np.bitwise_or.at(self.packed[u], j >> 3, (0x80 >> (j & 7)).astype(np.uint8))
+            self.counts[u] = len(j)
+
+    def tanimoto(self, person1, person2):
+        """
+        两个人评过分的物品集合的谷本系数
+        """
+        u1, u2 = self.user_index[person1], self.user_index[person2]
+        shared = _POPCOUNT[self.packed[u1] & self.packed[u2]].sum()
+        union = self.counts[u1] + self.counts[u2] - shared
+        if union == 0:
+            return 0.0
+        return float(shared) / union
+
+    def tanimoto_many(self, person):
+        """
+        批量模式，一个人与所有人的谷本系数
+        :return: 与self.users对应的数组
+        """
+        u = self.user_index[person]
+        shared = _POPCOUNT[self.packed & self.packed[u]].sum(axis=1)
+        union = self.counts + self.counts[u] - shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, shared / union.astype(np.float64), 0.0)
+
+    def top_matches(self, person, n=5):
+        """
+        与recommendations.top_matches相同，使用0/1评分的谷本系数
+        """
+        scores = self.tanimoto_many(person)
+        u = self.user_index[person]
+        ranked = ((float(scores[i]), other) for i, other in enumerate(self.users) if i != u)
+        return heapq.nlargest(n, ranked)
 
 
 if __name__ == '__main__':
@@ -83,3 +285,20 @@ if __name__ == '__main__':
 
     print '\n给 Toby 推荐电影，使用余弦相似度评价计算'
     print get_recommendations(critics, 'Toby', similarity=sim_cosine)
+
+    print '\n使用MovieLens数据集:'
+    from recommendations import load_movielens, top_matches
+    import time
+    prefs_dict = load_movielens()
+    vectors = SparseVectors(prefs_dict)
+    for sim in [sim_tanimoto, sim_cosine]:
+        start = time.time()
+        print '\t与87用户最相似的用户，使用%s逐对计算: %s' % (sim.__name__, top_matches(prefs_dict, '87', similarity=sim))
+        print '\t用时%.4f秒' % (time.time() - start)
+        start = time.time()
+        print '\t与87用户最相似的用户，使用稀疏向量批量计算: %s' % top_matches(vectors, '87', similarity=sim)
+        print '\t用时%.4f秒' % (time.time() - start)
+
+    start = time.time()
+    print '\t与87用户评过分的电影最相近的用户，使用位集合: %s' % BitsetIndex(prefs_dict).top_matches('87')
+    print '\t用时%.4f秒' % (time.time() - start)
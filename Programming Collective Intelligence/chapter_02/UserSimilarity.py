@@ -7,18 +7,22 @@
     类似书中基于物品过滤的方法建表,只是不需要再转置评分表.
 """
 
-from recommendations import top_matches, sim_pearson
+from recommendations import top_matches, sim_pearson, parallel_top_matches
 
 __author__ = 'Guti'
 
 
-def calculate_similar_users(prefs, n=5):
+def calculate_similar_users(prefs, n=5, workers=None):
     """
     计算相似用户表,不需要转置评分表
     :param prefs: 评分表
     :param n: 相似用户表中存储的相似用户个数
+    :param workers: 进程数,大于1时使用多进程计算
     :return: 相似用户表
     """
+    if workers is not None and workers > 1:
+        return parallel_top_matches(prefs, n=n, similarity=sim_pearson, workers=workers)
+
     # 相似用户表
     result = dict()
 
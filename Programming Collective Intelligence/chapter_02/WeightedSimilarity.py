@@ -0,0 +1,218 @@
+# -*- coding:utf-8 -*-
+"""
+第二章扩展,按共有物品个数加权的相似度.
+sim_pearson对只有两部共有电影的配对和有一百部共有电影的配对同样信任,
+共有物品很少时相关系数很容易为1或-1,推荐结果被噪声主导.
+
+方法:
+    记共有物品个数为n,原相似度为s:
+        显著性加权: s * min(n, cutoff) / cutoff, 共有物品不足cutoff个时按比例降低
+        收缩: s * n / (n + shrinkage), 共有物品越少越向0收缩
+    两者都可以设置最少共有个数min_overlap,不足时直接返回0,不再计算完整的相似度.
+    UserStatistics预先计算每个用户的评分个数, 平均分和范数,
+    两人中评分较少者的个数就是共有个数的上界,不足min_overlap时不必查找共有物品.
+    平均分和范数还用于centered_cosine,只需遍历一次共有物品.
+"""
+
+import collections
+from math import sqrt
+
+import numpy as np
+
+from recommendations import sim_pearson, _SHARED_AWARE
+from RatingMatrix import RatingMatrix, _co_rated_sums, sums_formula
+
+__author__ = 'Guti'
+
+Statistics = collections.namedtuple('Statistics', ['mean', 'norm', 'count'])
+
+
+class UserStatistics(object):
+    """
+    每个用户全部评分的平均分, 范数和个数,计算一次后重复使用
+    """
+    def __init__(self, prefs):
+        """
+        :param prefs: 评分表
+        """
+        self.prefs = prefs
+        self._stats = dict()
+        for person in prefs:
+            self.update(person)
+
+    def update(self, person):
+        """
+        重新计算一个用户的统计量,用户的评分变化后调用
+        """
+        ratings = self.prefs[person].values()
+        if not ratings:
+            self._stats[person] = Statistics(0.0, 0.0, 0)
+            return
+        mean = sum(ratings) / len(ratings)
+        # 范数按去掉平均分后的评分计算,用于centered_cosine
+        norm = sqrt(sum([pow(r - mean, 2) for r in ratings]))
+        self._stats[person] = Statistics(mean, norm, len(ratings))
+
+    def __getitem__(self, person):
+        return self._stats[person]
+
+    def __contains__(self, person):
+        return person in self._stats
+
+    def centered_cosine(self, prefs, person1, person2):
+        """
+        去掉各自平均分后的余弦相似度,平均分和范数使用全部评分,
+        只需遍历一次共有物品求乘积和
+        """
+        s1, s2 = self._stats[person1], self._stats[person2]
+        den = s1.norm * s2.norm
+        if den == 0:
+            return 0
+        ratings1, ratings2 = prefs[person1], prefs[person2]
+        p_sum = sum([(r - s1.mean) * (ratings2[item] - s2.mean) for item, r in ratings1.items()
+                     if item in ratings2])
+        return p_sum / den
+
+
+class _OverlapWeighted(object):
+    """
+    按共有物品个数加权的相似度函数,调用方式与被包装的函数相同,子类给出权重.
+    本身只按min_overlap过滤,共有物品足够时返回原相似度
+    """
+    # 名称前缀,与参数一起组成__name__
+    label = 'overlap'
+
+    def __init__(self, similarity=sim_pearson, min_overlap=1, stats=None):
+        """
+        :param similarity: 被包装的相似度函数
+        :param min_overlap: 最少共有物品个数,不足时相似度为0
+        :param stats: 评分表的UserStatistics,为None时第一次调用时计算
+        """
+        self.similarity = similarity
+        self.min_overlap = min_overlap
+        self.stats = stats
+        self.skipped = 0
+
+    def _settings(self):
+        """
+        帮助函数,名称中列出的参数
+        """
+        return [('min_overlap', self.min_overlap)]
+
+    @property
+    def __name__(self):
+        """
+        包括被包装的函数和参数的名称,如significance(sim_pearson,cutoff=50,min_overlap=1),
+        得分与被包装的函数不同,名称也不同
+        """
+        return '%s(%s)' % (self.label, ','.join([self.similarity.__name__] +
+                                                ['%s=%r' % setting for setting in self._settings()]))
+
+    def weight(self, n):
+        """
+        共有物品个数为n时的权重,n可以是数组,不加权时为1
+        """
+        return np.ones_like(n, dtype=np.float64)
+
+    def __call__(self, prefs, person1, person2):
+        if self.stats is None or self.stats.prefs is not prefs:
+            self.stats = UserStatistics(prefs)
+
+        # 评分个数是共有个数的上界,不足时不查找共有物品
+        if min(self.stats[person1].count, self.stats[person2].count) < self.min_overlap:
+            self.skipped += 1
+            return 0
+
+        ratings1, ratings2 = prefs[person1], prefs[person2]
+        if len(ratings2) < len(ratings1):
+            ratings1, ratings2 = ratings2, ratings1
+        si = dict((item, 1) for item in ratings1 if item in ratings2)
+        n = len(si)
+        if n == 0 or n < self.min_overlap:
+            self.skipped += 1
+            return 0
+
+        # 共有物品已经找到,可以直接使用的相似度函数不再重复查找
+        if self.similarity in _SHARED_AWARE:
+            score = self.similarity(prefs, person1, person2, si=si)
+        else:
+            score = self.similarity(prefs, person1, person2)
+        return score * float(self.weight(n))
+
+    def matrix_kernel(self, matrix, person):
+        """
+        评分矩阵上的向量化实现,RatingMatrix.similarities会使用它
+        """
+        sums = _co_rated_sums(matrix, person)
+        n = sums[0]
+        formula = sums_formula(self.similarity)
+        if formula is None:
+            scores = matrix.similarities(person, self.similarity)
+        else:
+            scores = formula(*sums)
+        return np.where((n > 0) & (n >= self.min_overlap), scores * self.weight(n), 0.0)
+
+
+class SignificanceWeighted(_OverlapWeighted):
+    """
+    显著性加权的相似度,共有物品不足cutoff个时按比例降低
+    """
+    label = 'significance'
+
+    def __init__(self, similarity=sim_pearson, cutoff=50, min_overlap=1, stats=None):
+        """
+        :param cutoff: 共有物品达到该个数时不再降低
+        """
+        super(SignificanceWeighted, self).__init__(similarity, min_overlap, stats)
+        self.cutoff = cutoff
+
+    def _settings(self):
+        return [('cutoff', self.cutoff)] + super(SignificanceWeighted, self)._settings()
+
+    def weight(self, n):
+        return np.minimum(n, self.cutoff) / float(self.cutoff)
+
+
+class ShrunkSimilarity(_OverlapWeighted):
+    """
+    收缩的相似度,共有物品越少越向0收缩
+    """
+    label = 'shrunk'
+
+    def __init__(self, similarity=sim_pearson, shrinkage=100, min_overlap=1, stats=None):
+        """
+        :param shrinkage: 收缩系数,共有物品个数等于它时相似度减半
+        """
+        super(ShrunkSimilarity, self).__init__(similarity, min_overlap, stats)
+        self.shrinkage = shrinkage
+
+    def _settings(self):
+        return [('shrinkage', self.shrinkage)] + super(ShrunkSimilarity, self)._settings()
+
+    def weight(self, n):
+        return n / (n + float(self.shrinkage))
+
+
+if __name__ == '__main__':
+    from recommendations import load_movielens, top_matches, get_recommendations, _transform_prefs
+    import time
+
+    prefs_dict = load_movielens()
+    item_prefs = _transform_prefs(prefs_dict)
+    user_stats = UserStatistics(prefs_dict)
+
+    print '与87用户最相似的5个用户'
+    print '\t皮尔逊相关系数: %s' % top_matches(prefs_dict, '87', similarity=sim_pearson)
+    for sim in [SignificanceWeighted(cutoff=50, min_overlap=10, stats=user_stats),
+                ShrunkSimilarity(shrinkage=100, min_overlap=10, stats=user_stats)]:
+        start = time.time()
+        matches = top_matches(prefs_dict, '87', similarity=sim)
+        print '\t%s: %s, 用时%.3f秒, 跳过%d个配对' % (
+            sim.__name__, matches, time.time() - start, sim.skipped)
+
+    print '\n使用显著性加权给87用户推荐电影'
+    print get_recommendations(prefs_dict, '87', similarity=SignificanceWeighted(stats=user_stats),
+                              item_prefs=item_prefs, k=10)
+
+    print '\n使用评分矩阵和收缩的相似度给87用户推荐电影'
+    print get_recommendations(RatingMatrix.from_prefs(prefs_dict), '87', similarity=ShrunkSimilarity(), k=10)
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import heapq
+import multiprocessing
 from math import sqrt
 
 __author__ = 'guti'
@@ -51,21 +53,23 @@ critics = {
 }
 
 
-def sim_distance(prefs, person1, person2):
+def sim_distance(prefs, person1, person2, si=None):
     """
     欧几里得距离评价
     :param prefs: 评分表
     :param person1: 评分表中人
     :param person2: 评分表中人
+    :param si: 两人共有的电影,为None时重新查找
     :return: 0-1之间的数, 1表示偏好完全一样, 0表示不相关
     """
-    # 相似表
-    si = dict()
+    if si is None:
+        # 相似表
+        si = dict()
 
-    # 获取有哪些是电影是person1和person2都有的
-    for item in prefs[person1]:
-        if item in prefs[person2]:
-            si[item] = 1
+        # 获取有哪些是电影是person1和person2都有的
+        for item in prefs[person1]:
+            if item in prefs[person2]:
+                si[item] = 1
 
     # 完全没有相似的电影
     if len(si) == 0:
@@ -78,19 +82,21 @@ def sim_distance(prefs, person1, person2):
     return 1 / (1 + sqrt(sum_of_squares))
 
 
-def sim_pearson(prefs, p1, p2):
+def sim_pearson(prefs, p1, p2, si=None):
     """
     皮尔逊相关系数
     :param prefs: 评分表
     :param p1: 评分表中人
     :param p2: 评分表中人
+    :param si: 两人共有的属性,为None时重新查找
     :return: 相关系数为-1到1的数, 1表示完全相同的看法
     """
-    # 获取两人共有的属性
-    si = dict()
-    for item in prefs[p1]:
-        if item in prefs[p2]:
-            si[item] = 1
+    if si is None:
+        # 获取两人共有的属性
+        si = dict()
+        for item in prefs[p1]:
+            if item in prefs[p2]:
+                si[item] = 1
 
     # 记录共有属性长度
     n = len(si)
@@ -116,45 +122,111 @@ def sim_pearson(prefs, p1, p2):
     return num / den
 
 
+# 可以直接使用共有属性列表的相似度函数
+_SHARED_AWARE = (sim_distance, sim_pearson)
+
+
 def top_matches(prefs, person, n=5, similarity=sim_pearson):
     """
     获取与用户A品味最相似的用户列表
-    :param prefs: 评分表
+    :param prefs: 评分表,也可以是RatingMatrix评分矩阵
     :param person: 待计算的用户
     :param n: 取n个最相似的其他用户
     :param similarity: 相似度计算方法,这里包括sim_pearson和sim_distance
     :return: 一个由元组(相似度, 其他用户)组成的列表,长度为n
     """
+    # 评分矩阵(RatingMatrix)一次计算与所有用户的相似度
+    if hasattr(prefs, 'top_matches'):
+        return prefs.top_matches(person, n=n, similarity=similarity)
+
     # 计算一个用户和其他的相似度
     # 使用元组(相似度, 其他用户)存储
-    scores = [(similarity(prefs, person, other), other) for other in prefs if other != person]
+    scores = ((similarity(prefs, person, other), other) for other in prefs if other != person)
 
-    scores.sort()
-    scores.reverse()
+    # n为返回top n个与用户相似的其他用户,使用大小为n的堆选取,不必对全部用户排序
+    return heapq.nlargest(n, scores)
 
-    # n为返回top n个与用户相似的其他用户
-    return scores[:n]
 
+class _Descending(object):
+    """
+    帮助类,包装排行表中的元组,使heapq的最小堆按从大到小的顺序弹出
+    """
+    __slots__ = ('entry',)
 
-def get_recommendations(prefs, person, similarity=sim_pearson):
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __lt__(self, other):
+        return self.entry > other.entry
+
+
+def _rank(entries, k=None):
     """
-    为用户A推荐他没有看过的电影
+    帮助函数,对(评分, 名称)元组排序
+    :param entries: 元组的可迭代对象
+    :param k: 只取前k个,使用大小为k的堆选取;为None时完整排序
+    :return: 从大到小排序的列表
+    """
+    if k is None:
+        return sorted(entries, reverse=True)
+    return heapq.nlargest(k, entries)
+
+
+def iter_ranked(entries):
+    """
+    按从大到小的顺序逐个产生(评分, 名称)元组.
+    建堆只需线性时间,之后每取一个为对数时间,只取前几个时不必完整排序.
+    :param entries: 元组的可迭代对象
+    :return: 生成器
+    """
+    heap = [_Descending(entry) for entry in entries]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap).entry
+
+
+def _co_rated(prefs, person, item_prefs):
+    """
+    帮助函数,通过物品到用户的倒排索引找出与用户至少有一部共同评分电影的其他用户
     :param prefs: 评分表
     :param person: 待计算的用户
-    :param similarity: 相似度计算方法,这里包括sim_pearson和sim_distance
-    :return: 一个由元组(估算评分, 其他用户)组成的列表
+    :param item_prefs: 转置后的评分表,即物品到用户的倒排索引
+    :return: 字典,其他用户到共有电影列表
+    """
+    shared = dict()
+    for item in prefs[person]:
+        for other in item_prefs.get(item, ()):
+            if other != person:
+                shared.setdefault(other, []).append(item)
+    return shared
+
+
+def _recommendation_scores(prefs, person, similarity=sim_pearson, item_prefs=None):
+    """
+    帮助函数,计算用户没有看过的电影的估算评分,不排序
+    :return: 一个由元组(估算评分, 电影名称)组成的列表
     """
+    # 评分矩阵(RatingMatrix)使用矩阵乘积计算评分权重
+    if hasattr(prefs, 'recommendation_scores'):
+        return prefs.recommendation_scores(person, similarity=similarity)
+
+    if item_prefs is None:
+        # 没有倒排索引时逐个比较其他用户,单次推荐临时建立索引反而更慢
+        candidates = ((other, None) for other in prefs if other != person)
+    else:
+        # 没有共同评分电影的用户相似度必然为0,只需计算倒排索引中出现的用户
+        candidates = _co_rated(prefs, person, item_prefs).iteritems()
+
     # 评分权重总计表
     totals = dict()
     # 用户相似度总计表
     sim_sums = dict()
-    for other in prefs:
-        # 不计算与自身的相似度
-        if other == person:
-            continue
-
-        # 用户间相似度值计算
-        sim = similarity(prefs, person, other)
+    for other, si in candidates:
+        # 用户间相似度值计算,有倒排索引时共有电影直接由索引得到
+        if si is not None and similarity in _SHARED_AWARE:
+            sim = similarity(prefs, person, other, si=si)
+        else:
+            sim = similarity(prefs, person, other)
 
         # 相似度小于等于0忽略
         if sim <= 0:
@@ -172,18 +244,42 @@ def get_recommendations(prefs, person, similarity=sim_pearson):
                 sim_sums.setdefault(item, 0)
                 sim_sums[item] += sim
 
-    # 排序,以元组(评分权重总和/相似度总和, 电影名称)存储
-    rankings = [(total/sim_sums[item], item) for item, total in totals.iteritems()]
-    rankings.sort(reverse=True)
-    return rankings
+    # 以元组(评分权重总和/相似度总和, 电影名称)存储
+    return [(total/sim_sums[item], item) for item, total in totals.iteritems()]
+
+
+def get_recommendations(prefs, person, similarity=sim_pearson, item_prefs=None, k=None):
+    """
+    为用户A推荐他没有看过的电影
+    :param prefs: 评分表,也可以是RatingMatrix评分矩阵
+    :param person: 待计算的用户
+    :param similarity: 相似度计算方法,这里包括sim_pearson和sim_distance
+    :param item_prefs: _transform_prefs转置后的评分表,用作倒排索引,只计算有共同评分的用户;
+                       为None时逐个比较所有用户,多次推荐时应预先计算并传入
+    :param k: 只返回前k个推荐,为None时返回全部
+    :return: 一个由元组(估算评分, 其他用户)组成的列表
+    """
+    return _rank(_recommendation_scores(prefs, person, similarity, item_prefs), k)
+
+
+def iter_recommendations(prefs, person, similarity=sim_pearson, item_prefs=None):
+    """
+    与get_recommendations相同,但按排名顺序逐个产生推荐,不生成完整的排行表
+    :return: 生成器,产生元组(估算评分, 电影名称)
+    """
+    return iter_ranked(_recommendation_scores(prefs, person, similarity, item_prefs))
 
 
 def _transform_prefs(prefs):
     """
     帮助函数,用于转置评分表
-    :param prefs: 原评分表
+    :param prefs: 原评分表,也可以是RatingMatrix评分矩阵
     :return: 一个转置后的评分表
     """
+    # 评分矩阵的转置与原矩阵共用评分数组,不复制
+    if hasattr(prefs, 'transpose'):
+        return prefs.transpose()
+
     result = dict()
     for person in prefs:
         for item in prefs[person]:
@@ -194,18 +290,76 @@ def _transform_prefs(prefs):
     return result
 
 
-def calculate_similar_items(prefs, n=10):
+# 多进程计算相似表时,子进程中由进程池的initializer保存的评分表
+_shared_prefs = None
+
+
+def _init_shared_prefs(prefs):
     """
-    计算相似物品表,通过评分表转置,复用求最相似的top_matches函数
+    帮助函数,进程池的initializer,在每个子进程中保存评分表
+    """
+    global _shared_prefs
+    _shared_prefs = prefs
+
+
+def _top_matches_shard(args):
+    """
+    帮助函数,在子进程中对一组键计算top_matches
+    :param args: 元组(键列表, 相似个数, 相似度计算方法)
+    :return: 一个由元组(键, 最相似列表)组成的列表
+    """
+    keys, n, similarity = args
+    return [(key, top_matches(_shared_prefs, key, n=n, similarity=similarity)) for key in keys]
+
+
+def parallel_top_matches(prefs, n=5, similarity=sim_pearson, workers=2):
+    """
+    多进程计算评分表中每个键最相似的n个键.
+    评分表通过进程池的initializer交给每个子进程,只在启动时传递一次,不会随任务序列化;
+    每个任务只传递一组键,最后按分片顺序合并结果,与串行计算的结果完全相同.
     :param prefs: 评分表
     :param n: 相似个数
-    :return: n个最相似的物品,及其评分
+    :param similarity: 相似度计算方法
+    :param workers: 进程数
+    :return: 相似表
     """
-    # 相似物品表
+    keys = list(prefs)
+    # 每个进程分到若干个分片,方便输出进度
+    shard_size = max(1, len(keys) // (workers * 4))
+    shards = [(keys[i:i + shard_size], n, similarity) for i in range(0, len(keys), shard_size)]
+
     result = dict()
+    pool = multiprocessing.Pool(workers, initializer=_init_shared_prefs, initargs=(prefs,))
+    try:
+        c = 0
+        for shard in pool.imap(_top_matches_shard, shards):
+            result.update(shard)
+            c += len(shard)
+            # 状态更新,类似进度条
+            print '%d / %d' % (c, len(keys))
+    finally:
+        pool.close()
+        pool.join()
+    return result
+
+
+def calculate_similar_items(prefs, n=10, workers=None):
+    """
+    计算相似物品表,通过评分表转置,复用求最相似的top_matches函数
+    :param prefs: 评分表,也可以是RatingMatrix评分矩阵
+    :param n: 相似个数
+    :param workers: 进程数,大于1时使用多进程计算
+    :return: n个最相似的物品,及其评分
+    """
     # 对评分表转置把物品作为外层键
     item_prefs = _transform_prefs(prefs)
 
+    if workers is not None and workers > 1:
+        return parallel_top_matches(item_prefs, n=n, similarity=sim_distance, workers=workers)
+
+    # 相似物品表
+    result = dict()
+
     c = 0
     for item in item_prefs:
         c += 1
@@ -218,14 +372,10 @@ def calculate_similar_items(prefs, n=10):
     return result
 
 
-def get_recommended_items(prefs, item_match, user):
+def _recommended_item_scores(prefs, item_match, user):
     """
-    为指定用户推荐商品,使用相似物品表
-    由于相似物品表只需要一次计算就可多次使用,这样的效率更高
-    :param prefs: 相似表
-    :param item_match: 使用calculate_similar_items计算出来的相似物品表
-    :param user: 需要物品推荐服务的用户
-    :return: 推荐排行表
+    帮助函数,使用相似物品表计算用户没有评分的物品的估算评分,不排序
+    :return: 一个由元组(估算评分, 物品)组成的列表
     """
     # 某个用户的评分表
     user_rating = prefs[user]
@@ -249,10 +399,29 @@ def get_recommended_items(prefs, item_match, user):
             total_sim.setdefault(item2, 0)
             total_sim[item2] += similarity
 
-    # 合计加权和除以相似度总和的物品列表
-    rankings = [(score / total_sim[item], item) for item, score in scores.items()]
-    rankings.sort(reverse=True)
-    return rankings
+    # 合计加权和除以相似度总和的物品列表,相似度总和为0的物品无法估算
+    return [(score / total_sim[item], item) for item, score in scores.items() if total_sim[item] != 0]
+
+
+def get_recommended_items(prefs, item_match, user, k=None):
+    """
+    为指定用户推荐商品,使用相似物品表
+    由于相似物品表只需要一次计算就可多次使用,这样的效率更高
+    :param prefs: 相似表
+    :param item_match: 使用calculate_similar_items计算出来的相似物品表
+    :param user: 需要物品推荐服务的用户
+    :param k: 只返回前k个推荐,为None时返回全部
+    :return: 推荐排行表
+    """
+    return _rank(_recommended_item_scores(prefs, item_match, user), k)
+
+
+def iter_recommended_items(prefs, item_match, user):
+    """
+    与get_recommended_items相同,但按排名顺序逐个产生推荐,不生成完整的排行表
+    :return: 生成器,产生元组(估算评分, 物品)
+    """
+    return iter_ranked(_recommended_item_scores(prefs, item_match, user))
 
 
 def load_movielens(path='data/movielens'):
@@ -308,8 +477,10 @@ if __name__ == '__main__':
     print '\n使用MovieLens数据集:'
     prefs_dict = load_movielens()
     print '\t依据相似用户给87用户的推荐电影'
-    print get_recommendations(prefs_dict, '87')[:30]
+    print get_recommendations(prefs_dict, '87', item_prefs=_transform_prefs(prefs_dict), k=30)
 
-    item_sim = calculate_similar_items(prefs_dict, n=50)
+    # 相似物品表只需计算一次,存入缓存后再次运行时直接读取
+    from NeighbourCache import NeighbourTableCache
+    item_sim = NeighbourTableCache().item_match(prefs_dict, n=50, dataset='movielens')
     print '\t使用相似物品表给87用户推荐电影'
-    print get_recommended_items(prefs_dict, item_sim, '87')[:30]
+    print get_recommended_items(prefs_dict, item_sim, '87', k=30)
@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+"""
+RecommendationService的测试,运行: python -m unittest test_RecommendationService
+"""
+
+import httplib
+import json
+import threading
+import time
+import unittest
+
+import RecommendationService
+from RecommendationService import RecommendationService as Service
+from recommendations import critics, sim_pearson
+
+__author__ = 'Guti'
+
+# 每次相似度计算的额外用时,使一次推荐明显慢于请求本身的开销
+_DELAY = 0.05
+
+
+def _slow_pearson(prefs, person1, person2):
+    time.sleep(_DELAY)
+    return sim_pearson(prefs, person1, person2)
+
+# 在创建进程池前注册,子进程fork时继承
+RecommendationService.SIMILARITIES['slow_pearson'] = _slow_pearson
+
+
+def _get(address, path):
+    connection = httplib.HTTPConnection(*address)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    body = json.loads(response.read())
+    connection.close()
+    return response.status, body
+
+
+class CoalescingTest(unittest.TestCase):
+    def setUp(self):
+        self.service = Service(critics, workers=2, deadline=10.0, port=0).start()
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_coalesced_requests_finish_with_the_computation(self):
+        # 先单独计算一次,得到一次推荐的用时
+        start = time.time()
+        status, expected = _get(self.service.address, '/recommendations?user=Toby&k=3&similarity=slow_pearson')
+        compute = time.time() - start
+        self.assertEqual(status, 200)
+
+        results = [None] * 6
+
+        def request(i):
+            begin = time.time()
+            status, body = _get(self.service.address, '/recommendations?user=Toby&k=2&similarity=slow_pearson')
+            results[i] = (status, body, time.time() - begin)
+
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(self.service.coalesced > 0)
+        for status, body, elapsed in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(body, expected[:2])
+            # 所有合并的请求都应在计算完成后立即返回,而不是等到截止时间
+            self.assertLess(elapsed, compute * 2 + 0.5)
+
+    def test_deadline_none_does_not_hang(self):
+        self.service.deadline = None
+        results = list()
+
+        def request():
+            results.append(_get(self.service.address, '/recommendations?user=Lisa%20Rose&similarity=slow_pearson'))
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5.0)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual([status for status, _ in results], [200] * 4)
+
+
+class MultipleServicesTest(unittest.TestCase):
+    def test_services_keep_their_own_data(self):
+        other = {'Ann': {'Movie A': 5.0, 'Movie B': 1.0}, 'Bob': {'Movie A': 4.0, 'Movie C': 5.0, 'Movie B': 2.0}}
+        first = Service(critics, workers=1, port=0).start()
+        second = Service(other, workers=1, port=0).start()
+        try:
+            self.assertEqual(_get(first.address, '/recommendations?user=Toby')[0], 200)
+            self.assertEqual(_get(first.address, '/recommendations?user=Ann')[0], 404)
+            status, body = _get(second.address, '/recommendations?user=Ann')
+            self.assertEqual(status, 200)
+            self.assertEqual([item for _, item in body], ['Movie C'])
+            status, body = _get(first.address, '/recommendations?user=Toby&k=1')
+            self.assertEqual(body[0][1], 'The Night Listener')
+        finally:
+            first.shutdown()
+            second.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,10 @@
 
 import math
 
+import numpy as np
+
+from Pairwise import register_metric
+
 __author__ = 'Guti'
 
 
@@ -36,6 +40,24 @@ def euclidean_similarity(v1, v2):
     return 1 / (1 + math.sqrt(sum_of_squares))
 
 
+def _manhattan_block(a, b):
+    """
+    帮助函数,manhattan_distance的块函数,a的每一行与b的每一行计算
+    """
+    return np.abs(a[:, None, :] - b[None, :, :]).sum(axis=2)
+
+
+def _euclidean_block(a, b):
+    """
+    帮助函数,euclidean_similarity的块函数,直接对差求平方和,避免展开公式的精度损失
+    """
+    return 1 / (1 + np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)))
+
+
+register_metric(manhattan_distance, _manhattan_block, broadcast=True)
+register_metric(euclidean_similarity, _euclidean_block, broadcast=True)
+
+
 if __name__ == '__main__':
     from clusters import readfile, hcluster, drawdendrogram
 
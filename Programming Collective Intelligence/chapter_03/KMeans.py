@@ -3,76 +3,300 @@
 第三章练习题5和6,修改了KMeans聚类,一并返回所有数据项的距离总和以及各自中心点.
 选用不同的k值查看聚类总距离随k的变化.
 可以看出,一开始簇的增加会使聚类效果更好,到9个簇的时候趋势逐渐衰弱.
+
+扩展:
+    每次迭代用Pairwise.cross一次算出所有数据项到所有中心点的距离,中心点按簇用numpy求平均.
+    kmeans_restarts用k-means++选择初始中心点:依次按到已选中心点最近距离的平方为概率抽取数据项,
+    初始中心点分散在数据中,比在各列范围内均匀随机更不容易陷入差的局部最优.
+    多次重启在子进程中并行运行,子进程通过fork继承数据表,返回距离总和最小的结果.
+    sweep_k把不同的k分给子进程并行计算,报告每个k的距离总和, 轮廓系数和用时,
+    也可以让k+1个簇从k个簇的中心点热启动.
 """
 
 from clusters import pearson, readfile
+from Pairwise import cross
+import multiprocessing
 import random
+import time
+
+import numpy as np
 
 __author__ = 'Guti'
 
 
+def _random_centers(data, k):
+    """
+    帮助函数,在每一列的范围内随机创建k个中心点,random.random()的调用顺序与原来相同
+    """
+    low, high = data.min(axis=0), data.max(axis=0)
+    return np.array([[random.random() * (high[i] - low[i]) + low[i] for i in range(data.shape[1])]
+                     for _ in range(k)])
+
+
+def _plus_plus_centers(data, k, distance, rng, initial=None):
+    """
+    帮助函数,k-means++选择初始中心点
+    :param data: 数据表,二维数组
+    :param rng: np.random.RandomState
+    :param initial: 已有的中心点数组,只补充到k个,用于从k-1个簇的结果热启动
+    :return: k×列数的数组
+    """
+    n = len(data)
+    if initial is None or len(initial) == 0:
+        centers = [data[rng.randint(n)]]
+    else:
+        centers = list(initial)
+    # 每个数据项到已选中心点的最近距离
+    nearest = cross(data, centers, distance).min(axis=1)
+    while len(centers) < k:
+        weights = np.maximum(nearest, 0) ** 2
+        total = weights.sum()
+        # 所有数据项都与已选中心点重合时均匀抽取
+        c = rng.choice(n, p=weights / total) if total > 0 else rng.randint(n)
+        centers.append(data[c])
+        nearest = np.minimum(nearest, cross(data, data[c:c + 1], distance)[:, 0])
+    return np.array(centers[:k], dtype=np.float64)
+
+
+def _kmeans_run(data, centers, distance, max_iterations=100, verbose=False):
+    """
+    帮助函数,从给定的中心点开始迭代,直到归类不再变化
+    :param data: 数据表,二维数组
+    :param centers: 初始中心点,k×列数的数组,会被修改
+    :return: 元组(距离总和, 中心点数组, 每个数据项所属簇的编号数组)
+    """
+    k = len(centers)
+    labels = distances = None
+    converged = False
+    for t in range(max_iterations):
+        if verbose:
+            print 'Iteration %d' % t
+        # 距离相同时取编号小的中心点
+        distances = cross(data, centers, distance)
+        nearest = np.argmin(distances, axis=1)
+
+        # 如果上次计算结果与这一次相同,过程结束
+        if labels is not None and np.array_equal(nearest, labels):
+            converged = True
+            break
+        labels = nearest
+
+        # 中心点位置更新,没有数据项的中心点保持不变
+        counts = np.bincount(labels, minlength=k)
+        for i in np.flatnonzero(counts):
+            centers[i] = data[labels == i].mean(axis=0)
+
+    # 没有收敛时中心点在最后一次归类后又更新过,重新计算距离
+    if not converged:
+        distances = cross(data, centers, distance)
+    sum_distance = float(distances[np.arange(len(data)), labels].sum())
+    return sum_distance, centers, labels
+
+
+def _as_result(run):
+    """
+    帮助函数,转换为kmeans_cluster_improve的返回格式
+    """
+    sum_distance, centers, labels = run
+    return sum_distance, centers.tolist(), [np.flatnonzero(labels == i).tolist() for i in range(len(centers))]
+
+
 def kmeans_cluster_improve(rows, distance=pearson, k=4):
     """
     k均值聚类实现,一并返回数据项的彼此距离总和和各自中心点.
     :param rows: 聚类的数据表.
     :param distance: 评价紧密度的函数.
     :param k: 簇的个数.
-    :return: 一个长为k的列表,每一行代表该簇所包含的节点.
+    :return: 元组(距离总和, 长为k的中心点列表, 长为k的列表,每一行代表该簇所包含的节点).
     """
-    # 数据集没一列的范围
-    ranges = [(min([row[i] for row in rows]), max([row[i] for row in rows])) for i in range(len(rows[0]))]
-
+    data = np.asarray(rows, dtype=np.float64)
     # 随机创建K个中心点
-    clusters = [[random.random() * (ranges[i][1] - ranges[i][0]) + ranges[i][0]
-                for i in range(len(rows[0]))] for _ in range(k)]
-
-    last_matches = best_matches = None
-    for t in range(100):
-        print 'Iteration %d' % t
-        best_matches = [list() for _ in range(k)]
-
-        # 每一行中寻找距离最近的中心点
-        for j in range(len(rows)):
-            row = rows[j]
-            best_match = 0
-            for i in range(k):
-                d = distance(clusters[i], row)
-                if d < distance(clusters[best_match], row):
-                    best_match = i
-            # 对数据集中每一行归类到相应的簇
-            best_matches[best_match].append(j)
+    centers = _random_centers(data, k)
+    return _as_result(_kmeans_run(data, centers, distance, verbose=True))
+
+
+# 并行重启时,子进程通过fork继承的(数据表, 距离函数, k, 最大迭代次数)
+_restart_context = None
+
+
+def _restart(seed):
+    """
+    帮助函数,用一个随机种子完成一次k-means++初始化和迭代
+    """
+    data, distance, k, max_iterations = _restart_context
+    centers = _plus_plus_centers(data, k, distance, np.random.RandomState(seed))
+    return _kmeans_run(data, centers, distance, max_iterations)
 
-        # 如果上次计算结果与这一次相同,过程结束
-        if best_matches == last_matches:
-            break
-        last_matches = best_matches
 
-        # 中心点位置更新
-        for i in range(k):
-            averages = [.0] * len(rows[0])
-            if len(best_matches[i]) > 0:
-                for row_id in best_matches[i]:
-                    for m in range(len(rows[row_id])):
-                        averages[m] += rows[row_id][m]
-                for j in range(len(averages)):
-                    averages[j] /= len(best_matches[i])
-                clusters[i] = averages
+def kmeans_restarts(rows, distance=pearson, k=4, restarts=8, workers=None, seed=None, max_iterations=100):
+    """
+    k-means++初始化的k均值聚类,多次重启取距离总和最小的结果.
+    :param rows: 聚类的数据表.
+    :param distance: 评价紧密度的函数.
+    :param k: 簇的个数.
+    :param restarts: 重启次数.
+    :param workers: 进程数,默认为CPU个数,不大于1时在当前进程中依次运行.
+    :param seed: 随机种子,相同的种子得到相同的结果,与进程数无关.
+    :param max_iterations: 每次重启的最大迭代次数.
+    :return: 与kmeans_cluster_improve相同,元组(距离总和, 中心点列表, 每个簇包含的节点列表).
+    """
+    global _restart_context
+    data = np.asarray(rows, dtype=np.float64)
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, restarts).tolist()
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, restarts)
+
+    _restart_context = (data, distance, k, max_iterations)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        runs = map(_restart, seeds) if pool is None else pool.map(_restart, seeds)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _restart_context = None
+    # 距离总和相同时取先重启的结果
+    return _as_result(min(runs, key=lambda run: run[0]))
+
+
+def silhouette(rows, labels, distance=pearson, sample=1000, seed=None):
+    """
+    轮廓系数,越接近1聚类越好.
+    数据项较多时只对抽样的数据项计算,每个抽样数据项仍与全部数据项比较.
+    :param rows: 聚类的数据表.
+    :param labels: 每个数据项所属簇的编号.
+    :param distance: 评价紧密度的函数.
+    :param sample: 抽样的数据项个数,None表示全部.
+    :param seed: 抽样的随机种子.
+    :return: 抽样数据项轮廓系数的平均值,只有一个簇时为0.
+    """
+    data = np.asarray(rows, dtype=np.float64)
+    labels = np.asarray(labels)
+    n, k = len(data), labels.max() + 1
+    counts = np.bincount(labels, minlength=k).astype(np.float64)
+    if np.count_nonzero(counts) < 2:
+        return 0.0
+    if sample is not None and sample < n:
+        picked = np.sort(np.random.RandomState(seed).choice(n, sample, replace=False))
+    else:
+        picked = np.arange(n)
+
+    # 抽样数据项到每个簇的距离之和
+    sums = np.zeros((len(picked), k))
+    distances = cross(data[picked], data, distance)
+    for i in np.flatnonzero(counts):
+        sums[:, i] = distances[:, labels == i].sum(axis=1)
+
+    own = labels[picked]
+    rows_index = np.arange(len(picked))
+    # 所在簇的平均距离不计自身,其他簇取平均距离最小的
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (sums[rows_index, own] - distances[rows_index, picked]) / (counts[own] - 1)
+        means = np.where(counts > 0, sums / counts, np.inf)
+    means[rows_index, own] = np.inf
+    b = means.min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(counts[own] > 1, (b - a) / np.maximum(a, b), 0.0)
+    return float(np.nan_to_num(scores).mean())
+
+
+# 扫描k值时,子进程通过fork继承的参数字典
+_sweep_context = None
 
-    # 距中心点的距离总和
-    sum_distance = sum([distance(clusters[i], rows[best_matches[i][j]]) for i in range(k)
-                        for j in range(len(best_matches[i]))])
-    return sum_distance, clusters, best_matches
 
+def _sweep_chain(ks):
+    """
+    帮助函数,依次计算一组k值,热启动时每个k从上一个k的中心点开始
+    :return: 每个k的结果字典组成的列表
+    """
+    context = _sweep_context
+    data, distance = context['data'], context['distance']
+    results = list()
+    centers = None
+    for k in ks:
+        start = time.time()
+        rng = np.random.RandomState(context['seeds'][k])
+        if context['warm_start'] and centers is not None and len(centers) < k:
+            run = _kmeans_run(data, _plus_plus_centers(data, k, distance, rng, centers), distance,
+                              context['max_iterations'])
+        else:
+            runs = [_kmeans_run(data, _plus_plus_centers(data, k, distance, rng), distance,
+                                context['max_iterations']) for _ in range(context['restarts'])]
+            run = min(runs, key=lambda r: r[0])
+        seconds = time.time() - start
+        centers = run[1]
+        results.append({'k': k,
+                        'inertia': run[0],
+                        'silhouette': silhouette(data, run[2], distance, context['silhouette_sample'],
+                                                 context['seeds'][k]),
+                        'seconds': seconds})
+    return results
+
+
+def sweep_k(rows, k_values, distance=pearson, workers=None, warm_start=False, restarts=1,
+            silhouette_sample=1000, seed=None, max_iterations=100):
+    """
+    对一组k值分别聚类,用于肘部法则选择k.
+    各个k在子进程中并行计算,子进程通过fork继承数据表.
+    :param rows: 聚类的数据表.
+    :param k_values: k值列表.
+    :param distance: 评价紧密度的函数.
+    :param workers: 进程数,默认为CPU个数,不大于1时在当前进程中依次运行.
+    :param warm_start: 为True时k值按从小到大分成连续的几段,每个进程计算一段,
+                       段内每个k保留上一个k的中心点,再用k-means++补充新的中心点,
+                       结果与进程数有关.
+    :param restarts: 不热启动时每个k的重启次数.
+    :param silhouette_sample: 计算轮廓系数时抽样的数据项个数,None表示全部.
+    :param seed: 随机种子.
+    :param max_iterations: 每次聚类的最大迭代次数.
+    :return: 按k排序的字典列表,包括k, 距离总和inertia, 轮廓系数silhouette和用时seconds.
+    """
+    global _sweep_context
+    k_values = sorted(set(k_values))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(k_values))
 
-def different_k(data_path, k_stop=12):
+    if warm_start:
+        tasks = [list(chunk) for chunk in np.array_split(k_values, max(workers, 1)) if len(chunk)]
+    else:
+        # 大的k用时较长,先提交
+        tasks = [[k] for k in reversed(k_values)]
+
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, len(k_values)).tolist()
+    _sweep_context = {'data': np.asarray(rows, dtype=np.float64), 'distance': distance,
+                      'warm_start': warm_start, 'restarts': restarts, 'max_iterations': max_iterations,
+                      'silhouette_sample': silhouette_sample, 'seeds': dict(zip(k_values, seeds))}
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        chains = map(_sweep_chain, tasks) if pool is None else pool.map(_sweep_chain, tasks, chunksize=1)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _sweep_context = None
+    return sorted((result for chain in chains for result in chain), key=lambda r: r['k'])
+
+
+def different_k(data_path, k_stop=12, workers=None, warm_start=False, seed=None, plus_plus=False):
     """
     模拟不同的k对距离总和的影响.
+    默认与原来相同,依次用kmeans_cluster_improve(各列范围内均匀随机的初始中心点)聚类.
     :param data_path: 数据的路径.
     :param k_stop: 模拟的k的范围.
+    :param workers: 进程数,默认为CPU个数,只用于plus_plus.
+    :param warm_start: 是否用上一个k的中心点热启动,见sweep_k,只用于plus_plus.
+    :param seed: 随机种子,只用于plus_plus.
+    :param plus_plus: 为True时改用sweep_k,k-means++初始化并在子进程中并行计算各个k.
     :return: 不同k值的列表.
     """
-    result = list()
     row_names, col_names, vec_data = readfile(data_path)
+    if plus_plus:
+        report = sweep_k(vec_data, range(2, k_stop), workers=workers, warm_start=warm_start, seed=seed)
+        return [(r['k'], r['inertia']) for r in report]
+
+    result = list()
     for k in range(2, k_stop):
         k_clust_tuple = kmeans_cluster_improve(vec_data, k=k)
         result.append((k, k_clust_tuple[0]))
@@ -82,3 +306,12 @@ def different_k(data_path, k_stop=12):
 if __name__ == '__main__':
     k_changes = different_k('data/blogdata.txt')
     print k_changes
+    print different_k('data/blogdata.txt', plus_plus=True, seed=0)
+
+    blog_titles, words, vec_data = readfile('data/blogdata.txt')
+    for r in sweep_k(vec_data, range(2, 21), warm_start=True, seed=0):
+        print 'k=%2d  距离总和 %8.4f  轮廓系数 %.4f  用时 %.3f秒' % (r['k'], r['inertia'], r['silhouette'], r['seconds'])
+
+    total, centroids, matches = kmeans_restarts(vec_data, k=10, restarts=8, seed=0)
+    print 'k-means++初始化, 8次重启, 距离总和 %.4f' % total
+    print [blog_titles[r] for r in matches[0]]
@@ -0,0 +1,204 @@
+# -*- coding:utf-8 -*-
+"""
+第三章扩展,小批量k均值聚类.
+kmeans_cluster和kmeans_cluster_improve需要readfile读入的全部数据项,每次迭代遍历一遍全部数据.
+这里从生成器中按固定大小分批读入数据项,每批数据归类后立即更新中心点,内存中只保留中心点.
+
+方法:
+    每个簇记录已归入的数据项个数n,新数据项以1/n的学习率拉动中心点,
+    即中心点始终是归入该簇的所有数据项的平均值,先归入的数据项不需要保留.
+    同一批中归入同一个簇的数据项一起更新,与逐个更新的结果相同.
+    中心点用第一批数据以k-means++选择,之后的数据只做一次归类和更新.
+    partial_fit可以随时加入新的数据项,如generatefeedvector新抓取的订阅源,不需要重新训练.
+"""
+
+import numpy as np
+
+from clusters import pearson
+from KMeans import _plus_plus_centers
+from Pairwise import cross
+
+__author__ = 'Guti'
+
+
+def read_columns(filename):
+    """
+    只读取数据文件的第一行列名,格式与readfile相同
+    """
+    with open(filename) as f:
+        return f.readline().strip().split('\t')[1:]
+
+
+def iter_file_rows(filename):
+    """
+    逐行读取数据文件,不把整个文件读入内存
+    :param filename: 文件路径,格式与readfile相同
+    :return: 生成器,每次给出(行名, 数据列表)
+    """
+    with open(filename) as f:
+        f.readline()
+        for line in f:
+            p = line.strip().split('\t')
+            yield p[0], [float(x) for x in p[1:]]
+
+
+def iter_batches(rows, batch_size):
+    """
+    把数据项的迭代器按固定大小分批
+    :return: 生成器,每次给出batch_size行的二维数组,最后一批可能较少
+    """
+    batch = list()
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield np.array(batch, dtype=np.float64)
+            batch = list()
+    if batch:
+        yield np.array(batch, dtype=np.float64)
+
+
+class MiniBatchKMeans(object):
+    """
+    小批量k均值聚类,中心点随数据项的读入不断更新
+    """
+    def __init__(self, k=4, distance=pearson, batch_size=100, columns=None, seed=None):
+        """
+        :param k: 簇的个数
+        :param distance: 评价紧密度的函数
+        :param batch_size: 每批的数据项个数
+        :param columns: 列名列表,partial_fit_feeds按它把单词计数表转换为数据项
+        :param seed: k-means++选择初始中心点的随机种子
+        """
+        self.k = k
+        self.distance = distance
+        self.batch_size = batch_size
+        self.columns = columns
+        self.rng = np.random.RandomState(seed)
+        self.centers = None
+        self.counts = np.zeros(k, dtype=np.int64)
+        # 初始化前数据项不足k个时暂存
+        self._pending = list()
+
+    def _initialize(self, batch):
+        """
+        帮助函数,用第一批数据以k-means++选择中心点
+        """
+        self.centers = _plus_plus_centers(batch, self.k, self.distance, self.rng)
+
+    def predict(self, rows):
+        """
+        一批数据项所属的簇
+        :param rows: 数据项列表或二维数组,也可以是单个数据项
+        :return: 每个数据项所属簇的编号数组
+        """
+        return np.argmin(cross(np.atleast_2d(rows), self.centers, self.distance), axis=1)
+
+    def partial_fit(self, rows):
+        """
+        加入一批数据项并更新中心点
+        :param rows: 数据项列表或二维数组,也可以是单个数据项,如vectorize的结果
+        :return: 本次传入的每个数据项所属簇的编号数组,数据项不足k个、还未初始化时返回None
+        """
+        batch = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+        size = len(batch)
+        if self.centers is None:
+            self._pending.extend(batch)
+            if len(self._pending) < self.k:
+                return None
+            batch = np.array(self._pending)
+            self._pending = list()
+            self._initialize(batch)
+
+        labels = self.predict(batch)
+        # 簇内平均值的增量更新,相当于每个数据项以1/n的学习率拉动中心点
+        added = np.bincount(labels, minlength=self.k)
+        for i in np.flatnonzero(added):
+            self.counts[i] += added[i]
+            members = batch[labels == i]
+            self.centers[i] += (members.sum(axis=0) - added[i] * self.centers[i]) / self.counts[i]
+        # 初始化时一并归类了之前暂存的数据项,只返回本次传入的数据项的编号
+        return labels[len(labels) - size:]
+
+    def fit(self, rows):
+        """
+        按批读入全部数据项
+        :param rows: 数据项的迭代器,如(row for name, row in iter_file_rows(path))
+        :return: self
+        """
+        for batch in iter_batches(rows, self.batch_size):
+            self.partial_fit(batch)
+        return self
+
+    def cluster(self, rows):
+        """
+        按当前的中心点对数据项归类,不更新中心点
+        :param rows: 数据项的迭代器
+        :return: 与kmeans_cluster_improve相同,元组(距离总和, 中心点列表, 每个簇包含的节点列表)
+        """
+        sum_distance = 0.0
+        best_matches = [list() for _ in range(self.k)]
+        offset = 0
+        for batch in iter_batches(rows, self.batch_size):
+            distances = cross(batch, self.centers, self.distance)
+            labels = np.argmin(distances, axis=1)
+            sum_distance += distances[np.arange(len(batch)), labels].sum()
+            for j, label in enumerate(labels.tolist()):
+                best_matches[label].append(offset + j)
+            offset += len(batch)
+        return float(sum_distance), self.centers.tolist(), best_matches
+
+    def vectorize(self, word_count):
+        """
+        单词计数表转换为数据项,不在列名中的单词被忽略
+        :param word_count: generatefeedvector.getwordcounts返回的单词计数表
+        """
+        if self.columns is None:
+            raise ValueError('没有列名,创建MiniBatchKMeans时需要指定columns,如read_columns(数据文件)')
+        return [float(word_count.get(word, 0)) for word in self.columns]
+
+    def partial_fit_feeds(self, urls):
+        """
+        抓取订阅源并加入聚类,需要feedparser
+        :param urls: 订阅源URL列表
+        :return: 由(订阅源标题, 所属簇的编号)组成的列表,簇编号在还未初始化时为None
+        """
+        if self.columns is None:
+            raise ValueError('没有列名,创建MiniBatchKMeans时需要指定columns,如read_columns(数据文件)')
+        # 只有抓取订阅源时才需要feedparser
+        from generatefeedvector import getwordcounts
+
+        titles, rows = list(), list()
+        for url in urls:
+            result = getwordcounts(url)
+            if result:
+                titles.append(result[0])
+                rows.append(self.vectorize(result[1]))
+        if not rows:
+            return []
+        labels = self.partial_fit(rows)
+        if labels is None:
+            return [(title, None) for title in titles]
+        return zip(titles, labels.tolist())
+
+
+if __name__ == '__main__':
+    from clusters import readfile
+    from KMeans import kmeans_restarts
+    import time
+
+    path = 'data/blogdata.txt'
+    model = MiniBatchKMeans(k=10, batch_size=20, columns=read_columns(path), seed=0)
+    start = time.time()
+    # 每一遍重新打开文件,数据项不全部读入内存
+    for _ in range(3):
+        model.fit(row for _, row in iter_file_rows(path))
+    total, centroids, matches = model.cluster(row for _, row in iter_file_rows(path))
+    print '小批量k均值, 3遍, 距离总和 %.4f, 用时 %.3f秒' % (total, time.time() - start)
+    blog_titles = [name for name, _ in iter_file_rows(path)]
+    print [blog_titles[r] for r in matches[0]]
+
+    blog_titles, words, vec_data = readfile(path)
+    print 'k-means++初始化, 8次重启, 距离总和 %.4f' % kmeans_restarts(vec_data, k=10, restarts=8, seed=0)[0]
+
+    # 加入新抓取的订阅源,需要网络和feedparser
+    # print model.partial_fit_feeds(['http://feeds.feedburner.com/37signals/beMH'])
@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+"""
+第三章扩展,批量计算距离矩阵.
+pearson, tanimoto, manhattan_distance和euclidean_similarity每次只比较两个列表,
+hcluster和scale_down要调用n^2次.这里按行分块,每一块与所有行的距离由numpy一次算出.
+
+方法:
+    每个距离函数注册一个块函数,输入两组行(二维数组),返回两两之间的距离.
+    clusters和Distance模块在定义距离函数时注册各自的块函数,这里不需要导入它们.
+    没有注册的距离函数退回逐对调用.
+    结果可以是压缩距离矩阵(只存i<j的配对,与hcluster使用的格式相同)或方阵,
+    float32模式下结果占用一半的内存,计算仍然使用float64.
+    hcluster和scale_down的dtype参数传给这里,之后的更新也保持同样的数据类型.
+"""
+
+import numpy as np
+
+__author__ = 'Guti'
+
+# 距离函数到块函数的映射
+_METRICS = dict()
+
+# 自动分块时每一块中间结果的元素个数上限
+_BLOCK_ELEMENTS = 1 << 22
+
+
+def register_metric(distance, kernel, broadcast=False):
+    """
+    注册距离函数的块函数
+    :param distance: 逐对计算的距离函数,以两个列表为参数
+    :param kernel: 以两个二维数组(m行和p行)为参数,返回m×p距离数组的函数
+    :param broadcast: 块函数是否使用 m×p×列数 的广播中间结果,用于自动选择分块大小
+    """
+    _METRICS[distance] = (kernel, broadcast)
+
+
+def _as_array(rows):
+    return np.asarray(rows, dtype=np.float64)
+
+
+def _scalar_kernel(distance):
+    """
+    帮助函数,没有注册块函数的距离函数逐对调用
+    """
+    def kernel(a, b):
+        return np.array([[distance(list(u), list(v)) for v in b] for u in a], dtype=np.float64)
+    return kernel
+
+
+def _block_rows(distance, rows, columns, block_size):
+    """
+    帮助函数,选择块函数和每块的行数
+    """
+    kernel, broadcast = _METRICS.get(distance, (None, False))
+    if kernel is None:
+        kernel = _scalar_kernel(distance)
+    if block_size is None:
+        per_row = max(rows, 1) * (max(columns, 1) if broadcast else 1)
+        block_size = max(1, _BLOCK_ELEMENTS // per_row)
+    return kernel, block_size
+
+
+def cross(rows, others, distance, dtype=np.float64, block_size=None):
+    """
+    计算两组行之间的距离,如数据行与k均值的中心点
+    :param rows: 数据表,n行
+    :param others: 另一组行,p行
+    :param distance: 距离函数
+    :param dtype: 结果的数据类型,np.float32时内存减半
+    :param block_size: 每块的行数,为None时自动选择
+    :return: n×p的距离数组,第i行第j列为distance(rows[i], others[j])
+    """
+    a, b = _as_array(rows), _as_array(others)
+    kernel, block_size = _block_rows(distance, len(b), a.shape[1], block_size)
+    result = np.empty((len(a), len(b)), dtype=dtype)
+    for start in range(0, len(a), block_size):
+        result[start:start + block_size] = kernel(a[start:start + block_size], b)
+    return result
+
+
+def pairwise(rows, distance, square=False, dtype=np.float64, block_size=None):
+    """
+    计算数据表中所有配对的距离
+    :param rows: 数据表,n行
+    :param distance: 距离函数,如clusters.pearson
+    :param square: 为False时返回压缩距离矩阵,按(0,1), (0,2), ..., (1,2), ...的顺序存储i<j的配对;
+                   为True时返回n×n方阵,对角线为distance(rows[i], rows[i])
+    :param dtype: 结果的数据类型,np.float32时内存减半
+    :param block_size: 每块的行数,为None时自动选择
+    :return: 长为n*(n-1)/2的数组或n×n数组
+    """
+    a = _as_array(rows)
+    n = len(a)
+    kernel, block_size = _block_rows(distance, n, a.shape[1] if a.ndim == 2 else 0, block_size)
+
+    if square:
+        result = np.empty((n, n), dtype=dtype)
+    else:
+        result = np.empty(n * (n - 1) // 2, dtype=dtype)
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        if square:
+            result[start:end] = kernel(a[start:end], a)
+            continue
+        # 压缩距离矩阵只需要每行中位于其后的列
+        block = kernel(a[start:end], a[start + 1:])
+        for i in range(start, end):
+            offset = n * i - i * (i + 1) // 2
+            result[offset:offset + n - i - 1] = block[i - start, i - start:]
+    return result
+
+
+def square_form(condensed, n):
+    """
+    压缩距离矩阵转换为方阵,对角线为0
+    :param condensed: 压缩距离矩阵
+    :param n: 行数
+    :return: n×n数组
+    """
+    result = np.zeros((n, n), dtype=condensed.dtype)
+    rows, columns = np.triu_indices(n, 1)
+    result[rows, columns] = condensed
+    result[columns, rows] = condensed
+    return result
@@ -2,8 +2,12 @@
 
 import random
 from math import sqrt
+
+import numpy as np
 from PIL import Image, ImageDraw
 
+from Pairwise import pairwise, cross, register_metric
+
 __author__ = 'Guti'
 
 
@@ -63,6 +67,24 @@ def pearson(v1, v2):
     return 1.0 - num / den
 
 
+def _pearson_block(a, b):
+    """
+    帮助函数,pearson的块函数,a的每一行与b的每一行计算
+    """
+    length = float(a.shape[1])
+    sum1, sum2 = a.sum(axis=1)[:, None], b.sum(axis=1)[None, :]
+    sum1_sq, sum2_sq = (a ** 2).sum(axis=1)[:, None], (b ** 2).sum(axis=1)[None, :]
+    p_sum = a.dot(b.T)
+
+    num = p_sum - (sum1 * sum2) / length
+    den = np.sqrt(np.maximum((sum1_sq - sum1 ** 2 / length) * (sum2_sq - sum2 ** 2 / length), 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den == 0, 0.0, 1.0 - num / den)
+
+
+register_metric(pearson, _pearson_block)
+
+
 class BICluster(object):
     """
     二叉树的节点类,最后形成的二叉树用于表示聚类结果.
@@ -77,56 +99,150 @@ class BICluster(object):
         self.id = id
 
 
-def hcluster(rows, distance=pearson):
+def _condensed_index(n, i):
+    """
+    帮助函数,压缩距离矩阵中第i行各元素的位置.
+    压缩距离矩阵按 (0,1), (0,2), ..., (0,n-1), (1,2), ... 的顺序只存储i<j的配对.
+    :param n: 数据项个数.
+    :param i: 行号.
+    :return: 长为n的位置数组,第i个位置没有意义.
+    """
+    j = np.arange(n)
+    low, high = np.minimum(i, j), np.maximum(i, j)
+    return n * low - low * (low + 1) // 2 + (high - low - 1)
+
+
+# Lance-Williams公式,由两个子簇到其他簇的距离得到合并后的距离
+_LINKAGES = {
+    'single': lambda d1, d2, n1, n2: np.minimum(d1, d2),
+    'complete': lambda d1, d2, n1, n2: np.maximum(d1, d2),
+    'average': lambda d1, d2, n1, n2: (n1 * d1 + n2 * d2) / float(n1 + n2),
+}
+
+
+def hcluster(rows, distance=pearson, linkage='centroid', distances=None, dtype=np.float64):
     """
     分级聚类实现.
     通过将最小距离配对聚类后缩小聚类列表,最后形成一个由二叉树表示的分级结果.
+    距离存储在压缩距离矩阵中,并记录每个簇的最近邻,每次合并只需更新受影响的簇,
+    合并次数为n-1,每次合并的计算量为O(n),总计O(n^2).
     :param rows: 聚类的数据表.
     :param distance: 评价紧密度的函数.
+    :param linkage: 簇间距离的计算方式:
+                    'centroid' 合并后的向量为两个向量的平均,用distance重新计算距离;
+                    'single', 'complete', 'average' 分别为最近, 最远, 平均距离,由Lance-Williams公式更新.
+    :param distances: 预先计算的压缩距离矩阵,为None时用Pairwise.pairwise计算.
+    :param dtype: 距离矩阵的数据类型,np.float32时内存减半;传入distances时沿用其数据类型.
     :return: 二叉树的根节点.
     """
-    # 聚类中各个向量的距离记录
-    distances = dict()
-    # 当前聚类簇的id
-    current_clust_id = -1
+    if linkage != 'centroid' and linkage not in _LINKAGES:
+        raise ValueError('unknown linkage: %s' % linkage)
 
+    n = len(rows)
     # 待聚类的实例列表,实例中的向量为读取数据的行,标志为其行号
-    clust = [BICluster(rows[i], id=i) for i in range(len(rows))]
-
-    while len(clust) > 1:
-        # 配对初始化为第0,第1个配对
-        lowest_pair = (0, 1)
-        closest = distance(clust[0].vec, clust[1].vec)
-
-        # 遍历所有配对,寻找最小距离的配对
-        # 采用了第一次计算所有配对的距离,之后直接查询
-        for i in range(len(clust)):
-            for j in range(i+1, len(clust)):
-                if (clust[i].id, clust[j].id) not in distances:
-                    distances[(clust[i].id, clust[j].id)] = distance(clust[i].vec, clust[j].vec)
+    clust = [BICluster(rows[i], id=i) for i in range(n)]
+    if n == 1:
+        return clust[0]
+
+    if distances is None:
+        distances = pairwise(rows, distance, dtype=dtype)
+    # 合并时会更新距离,不修改传入的数组;保持float32等数据类型,不转换为float64
+    distances = np.array(distances)
+    if distances.dtype.kind != 'f':
+        distances = distances.astype(np.float64)
+    # 每个簇的向量,合并后的向量存放在新簇的位置
+    vectors = np.array(rows, dtype=np.float64)
+
+    # 仍然存在的簇, 簇的大小, 创建顺序(叶子节点为行号,分支节点排在所有叶子之后)
+    active = np.ones(n, dtype=bool)
+    sizes = np.ones(n)
+    order = np.arange(n)
+
+    def row_of(i):
+        """
+        第i个簇到所有簇的距离,自身和已经合并的簇为无穷大
+        """
+        row = distances[_condensed_index(n, i)]
+        row[i] = np.inf
+        row[~active] = np.inf
+        return row
+
+    def argmin_of(row, candidates):
+        """
+        候选簇中距离最小的一个,距离相同时取先创建的
+        """
+        values = row[candidates]
+        ties = candidates[values == values.min()]
+        return ties[np.argmin(order[ties])]
+
+    # 每个簇的最近邻和最近距离
+    everyone = np.arange(n)
+    nearest = np.empty(n, dtype=np.int64)
+    nearest_dist = np.empty(n, dtype=distances.dtype)
+    for i in range(n):
+        row = row_of(i)
+        nearest[i] = argmin_of(row, everyone)
+        nearest_dist[i] = row[nearest[i]]
+
+    for step in range(n - 1):
+        # 最近距离最小的簇与其最近邻就是最小距离配对
+        # 距离相同时与逐个配对遍历的顺序一致: 取(先创建的簇, 后创建的簇)的创建顺序最小的配对
+        ties = np.flatnonzero(nearest_dist == nearest_dist.min())
+        first = np.minimum(order[ties], order[nearest[ties]])
+        second = np.maximum(order[ties], order[nearest[ties]])
+        i = int(ties[np.lexsort((second, first))[0]])
+        j = int(nearest[i])
+        closest = float(nearest_dist[i])
+
+        # 先创建的簇作为左子节点
+        left, right = (i, j) if order[i] < order[j] else (j, i)
+        if linkage == 'centroid':
+            merge_vec = (vectors[left] + vectors[right]) / 2.0
+        else:
+            # 按簇的大小加权平均,即簇中所有行的平均
+            merge_vec = (vectors[left] * sizes[left] + vectors[right] * sizes[right]) / (sizes[left] + sizes[right])
 
-                d = distances[(clust[i].id, clust[j].id)]
+        # 所有分支节点的标志为负数,分支节点其实是计算的中间量,没有实际意义
+        new_cluster = BICluster(merge_vec.tolist(), left=clust[left], right=clust[right],
+                                distance=closest, id=-(step + 1))
+
+        # 新的簇占用i的位置,j不再存在
+        row_i, row_j = row_of(i), row_of(j)
+        active[j] = False
+        nearest_dist[j] = np.inf
+        others = np.flatnonzero(active)
+        others = others[others != i]
+
+        new_row = np.full(n, np.inf, dtype=distances.dtype)
+        if linkage == 'centroid':
+            new_row[others] = cross(vectors[others], merge_vec[None, :], distance)[:, 0]
+        else:
+            new_row[others] = _LINKAGES[linkage](row_i[others], row_j[others], sizes[i], sizes[j])
 
-                if d < closest:
-                    closest = d
-                    lowest_pair = (i, j)
+        clust[i], clust[j] = new_cluster, None
+        vectors[i] = merge_vec
+        sizes[i] += sizes[j]
+        order[i] = n + step
+        index = _condensed_index(n, i)
+        distances[index[others]] = new_row[others]
 
-        # 由最小距离配对生成的新的向量
-        merge_vec = [(clust[lowest_pair[0]].vec[i] + clust[lowest_pair[1]].vec[i]) / 2.0
-                     for i in range(len(clust[0].vec))]
+        if len(others) == 0:
+            break
+        nearest[i] = argmin_of(new_row, others)
+        nearest_dist[i] = new_row[nearest[i]]
 
-        # 生成新的聚类节点
-        new_cluster = BICluster(merge_vec, left=clust[lowest_pair[0]],
-                                right=clust[lowest_pair[1]],
-                                distance=closest, id=current_clust_id)
+        # 最近邻是合并前的两个簇之一,需要重新查找
+        stale = others[(nearest[others] == i) | (nearest[others] == j)]
+        # 其他簇只需与新簇比较,新簇最后创建,距离相同时不替换
+        closer = others[new_row[others] < nearest_dist[others]]
+        nearest[closer] = i
+        nearest_dist[closer] = new_row[closer]
+        for k in stale:
+            row = row_of(k)
+            nearest[k] = argmin_of(row, everyone)
+            nearest_dist[k] = row[nearest[k]]
 
-        # 所有分支节点的标志为负数,分支节点其实是计算的中间量,没有实际意义
-        current_clust_id -= 1
-        # 注意: 这里不能使用直接删除的方式,由于要删除配对,所以索引会变化
-        # 改进的方法是记录配对对应的值,然后删除
-        clust = [x for x in clust if x != clust[lowest_pair[0]] and x != clust[lowest_pair[1]]]
-        clust.append(new_cluster)
-    return clust[0]
+    return clust[int(np.flatnonzero(active)[0])]
 
 
 def print_clust(clust, labels=None, n=0):
@@ -272,6 +388,7 @@ def kmeans_cluster(rows, distance=pearson, k=4):
     :param k: 簇的个数.
     :return: 一个长为k的列表,每一行代表该簇所包含的节点.
     """
+    data = np.asarray(rows, dtype=np.float64)
     # 数据集没一列的范围
     ranges = [(min([row[i] for row in rows]), max([row[i] for row in rows])) for i in range(len(rows[0]))]
 
@@ -284,32 +401,21 @@ def kmeans_cluster(rows, distance=pearson, k=4):
         print 'Iteration %d' % t
         best_matches = [list() for _ in range(k)]
 
-        # 每一行中寻找距离最近的中心点
+        # 每一行中寻找距离最近的中心点,距离相同时取编号小的中心点
+        nearest = np.argmin(cross(data, clusters, distance), axis=1)
         for j in range(len(rows)):
-            row = rows[j]
-            best_match = 0
-            for i in range(k):
-                d = distance(clusters[i], row)
-                if d < distance(clusters[best_match], row):
-                    best_match = i
             # 对数据集中每一行归类到相应的簇
-            best_matches[best_match].append(j)
+            best_matches[nearest[j]].append(j)
 
         # 如果上次计算结果与这一次相同,过程结束
         if best_matches == last_matches:
             break
         last_matches = best_matches
 
-        # 中心点位置更新
+        # 中心点位置更新,没有数据项的中心点保持不变
         for i in range(k):
-            averages = [.0] * len(rows[0])
             if len(best_matches[i]) > 0:
-                for row_id in best_matches[i]:
-                    for m in range(len(rows[row_id])):
-                        averages[m] += rows[row_id][m]
-                for j in range(len(averages)):
-                    averages[j] /= len(best_matches[i])
-                clusters[i] = averages
+                clusters[i] = data[best_matches[i]].mean(axis=0).tolist()
     return best_matches
 
 
@@ -332,49 +438,56 @@ def tanimoto(v1, v2):
     return 1.0 - float(shr) / (c1 + c2 - shr)
 
 
-def scale_down(data, distance=pearson, rate=.001):
+def _tanimoto_block(a, b):
+    """
+    帮助函数,tanimoto的块函数,a的每一行与b的每一行计算
+    """
+    a, b = (a != 0).astype(np.float64), (b != 0).astype(np.float64)
+    shr = a.dot(b.T)
+    union = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :] - shr
+    # 两个向量都全为0时没有喜欢项,视为完全不同
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union == 0, 1.0, 1.0 - shr / union)
+
+
+register_metric(tanimoto, _tanimoto_block)
+
+
+def scale_down(data, distance=pearson, rate=.001, dtype=np.float64):
     """
     将多维数据降维后,投射到二维空间.
     :param data: 数据向量集.
     :param distance: 距离计算函数.
     :param rate: 移动比例.
+    :param dtype: 距离方阵和坐标的数据类型,np.float32时内存减半.
     :return: 投射到二维平面的坐标.
     """
     n = len(data)
 
     # 每一队数据项之间的真实距离
-    real_dist = [[distance(data[i], data[j]) for j in range(n)] for i in range(n)]
+    real_dist = pairwise(data, distance, square=True, dtype=dtype)
 
     # 随机初始化节点在二维空间的起始位置
-    loc = [[random.random(), random.random()] for _ in range(n)]
-    fake_dist = [[.0 for j in range(n)] for i in range(n)]
+    loc = np.array([[random.random(), random.random()] for _ in range(n)], dtype=dtype)
+    # 不计算节点与自身的误差
+    off_diagonal = ~np.eye(n, dtype=bool)
 
     last_error = None
     for m in range(1000):
-        # 投影后的距离
-        for i in range(n):
-            for j in range(n):
-                fake_dist[i][j] = sqrt(sum([pow(loc[i][x] - loc[j][x], 2)
-                                            for x in range(len(loc[i]))]))
-
-        # 节点移动到的位置
-        grad = [[.0, .0] for _ in range(n)]
-
-        total_error = 0
-        for k in range(n):
-            for j in range(n):
-                if j == k:
-                    continue
-                # 误差值等于目标距离与当前距离的差值百分比
-                error_term = (fake_dist[j][k] - real_dist[j][k]) / real_dist[j][k]
-                # 每一个节点都需要根据误差的多少移动
-                grad[k][0] += ((loc[k][0] - loc[j][0]) / fake_dist[j][k]) * error_term
-                grad[k][1] += ((loc[k][1] - loc[j][1]) / fake_dist[j][k]) * error_term
-
-                # 记录总的误差
-                total_error += abs(error_term)
-
-        # print total_error
+        # 投影后的距离, diff[k][j] = loc[k] - loc[j]
+        diff = loc[:, None, :] - loc[None, :, :]
+        fake_dist = np.sqrt((diff ** 2).sum(axis=2))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 误差值等于目标距离与当前距离的差值百分比
+            error_term = np.where(off_diagonal, (fake_dist - real_dist) / real_dist, 0.0)
+            weights = np.where(off_diagonal, error_term / fake_dist, 0.0)
+
+        # 每一个节点都需要根据误差的多少移动: grad[k] = sum_j (loc[k] - loc[j]) / fake_dist[j][k] * error_term[j][k]
+        grad = (diff * weights.T[:, :, None]).sum(axis=1)
+
+        # 记录总的误差
+        total_error = np.abs(error_term).sum()
 
         # 节点移动后更糟后,过程结束
         if last_error and last_error < total_error:
@@ -382,10 +495,8 @@ def scale_down(data, distance=pearson, rate=.001):
         last_error = total_error
 
         # 根据rate参数与grad值相乘的结果,移动每一个节点
-        for k in range(n):
-            loc[k][0] -= rate * grad[k][0]
-            loc[k][1] -= rate * grad[k][1]
-    return loc
+        loc -= rate * grad
+    return loc.tolist()
 
 
 def draw_2d(data, labels, jpeg='mds2d.jpg'):
@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+"""
+MiniBatchKMeans的测试,运行: python -m unittest test_MiniBatchKMeans
+"""
+
+import sys
+import types
+import unittest
+
+import numpy as np
+
+from MiniBatchKMeans import MiniBatchKMeans
+
+__author__ = 'Guti'
+
+ROWS = [[1.0, 2.0, 9.0], [9.0, 1.0, 2.0], [2.0, 9.0, 1.0], [1.0, 3.0, 8.0], [8.0, 1.0, 3.0], [3.0, 8.0, 1.0]]
+
+
+class PartialFitTest(unittest.TestCase):
+    def test_labels_only_for_rows_of_this_call(self):
+        model = MiniBatchKMeans(k=3, seed=0)
+        # 不足k个数据项时暂存,不返回编号
+        self.assertIsNone(model.partial_fit(ROWS[0]))
+        self.assertIsNone(model.partial_fit([ROWS[1]]))
+        labels = model.partial_fit([ROWS[2], ROWS[3]])
+        self.assertEqual(len(labels), 2)
+        self.assertEqual(model.counts.sum(), 4)
+        self.assertEqual(labels.tolist(), model.predict([ROWS[2], ROWS[3]]).tolist())
+        self.assertEqual(len(model.partial_fit(ROWS[4])), 1)
+
+    def test_feeds_get_their_own_labels(self):
+        columns = ['a', 'b', 'c']
+        fake = types.ModuleType('generatefeedvector')
+        fake.getwordcounts = lambda url: (url, dict(zip(columns, ROWS[int(url)])))
+        original = sys.modules.get('generatefeedvector')
+        sys.modules['generatefeedvector'] = fake
+        try:
+            model = MiniBatchKMeans(k=3, columns=columns, seed=0)
+            self.assertEqual(model.partial_fit_feeds(['0', '1']), [('0', None), ('1', None)])
+            labelled = model.partial_fit_feeds(['2', '3'])
+            self.assertEqual([title for title, _ in labelled], ['2', '3'])
+            self.assertEqual([label for _, label in labelled],
+                             model.predict([ROWS[2], ROWS[3]]).tolist())
+        finally:
+            if original is None:
+                del sys.modules['generatefeedvector']
+            else:
+                sys.modules['generatefeedvector'] = original
+
+    def test_feeds_require_columns(self):
+        self.assertRaises(ValueError, MiniBatchKMeans(k=3).partial_fit_feeds, ['0'])
+
+    def test_batch_update_is_running_mean(self):
+        model = MiniBatchKMeans(k=2, seed=0)
+        model.partial_fit(ROWS[:2])
+        labels = model.partial_fit(ROWS[2:])
+        self.assertEqual(len(labels), 4)
+        self.assertEqual(model.counts.sum(), 6)
+        self.assertTrue(np.all(np.isfinite(model.centers)))
+
+
+if __name__ == '__main__':
+    unittest.main()